@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+import hashlib
+from django.views.decorators.http import condition
+
+
+def make_etag(*values):
+    return hashlib.md5(repr(values)).hexdigest()
+
+
+def conditional_view(view, etag=None, last_modified=None):
+    """
+    Wrap a view with django's condition decorator, for validators that have already been computed.
+
+    Computing them beforehand lets ETag and Last-Modified come from the same query, which condition() would otherwise
+    run once for each of them.
+    """
+    return condition(etag_func=lambda request, *args, **kwargs: etag,
+                     last_modified_func=lambda request, *args, **kwargs: last_modified)(view)
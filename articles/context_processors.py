@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+from django.conf import settings
+from articles.models import Article
+
+
+def page_cache(request):
+    """
+    What the {% cache %} fragments of the article pages are keyed by: the generation is only looked up when used.
+    """
+    return {
+        'page_cache_generation': Article.objects.get_page_cache_generation,
+        'fragment_cache_timeout': settings.FRAGMENT_CACHE_TIMEOUT,
+    }
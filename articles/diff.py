@@ -1,9 +1,98 @@
 import itertools
 import re
 
+from django.conf import settings
 import diff_match_patch
 
 
+def hunked_diff(dmp, old_text, new_text):
+    """
+    Diffs line by line first, then character by character within each run of changed lines only.
+
+    This way the cost of a diff depends on the size of the changes rather than on the size of the texts.
+    """
+    old_chars, new_chars, lines = dmp.diff_linesToChars(old_text, new_text)
+    line_diff = dmp.diff_main(old_chars, new_chars, False)
+    dmp.diff_charsToLines(line_diff, lines)
+    return refine_hunks(dmp, line_diff)
+
+
+def refine_hunks(dmp, line_diff):
+    """
+    Diff character by character each run of deleted and inserted lines of a line diff, leaving the rest as it is.
+    """
+    diff = []
+    deleted, inserted = [], []
+    for change_type, text in line_diff + [(dmp.DIFF_EQUAL, '')]:
+        if change_type == dmp.DIFF_DELETE:
+            deleted.append(text)
+        elif change_type == dmp.DIFF_INSERT:
+            inserted.append(text)
+        else:
+            if deleted or inserted:
+                hunk = dmp.diff_main(''.join(deleted), ''.join(inserted), False)
+                dmp.diff_cleanupSemantic(hunk)
+                diff.extend(hunk)
+                deleted, inserted = [], []
+            if text:
+                diff.append((change_type, text))
+    return diff
+
+
+def count_changes(old_text, new_text):
+    """
+    Count the lines and the characters added and removed going from old_text to new_text.
+
+    Characters are counted on the same diff the diff view shows, so a line with a typo fixed counts as one line
+    removed and one added, but as a couple of characters only.
+
+    :return: :rtype: dict with lines_added, lines_removed, chars_added and chars_removed
+    """
+    dmp = diff_match_patch.diff_match_patch()
+    dmp.Diff_Timeout = settings.DIFF_TIMEOUT
+    stats = dict.fromkeys(['lines_added', 'lines_removed', 'chars_added', 'chars_removed'], 0)
+    # Every line becomes a single character, so the diff is a line diff
+    old_chars, new_chars, lines = dmp.diff_linesToChars(old_text, new_text)
+    line_diff = dmp.diff_main(old_chars, new_chars, False)
+    for change_type, chars in line_diff:
+        if change_type == dmp.DIFF_INSERT:
+            stats['lines_added'] += len(chars)
+        elif change_type == dmp.DIFF_DELETE:
+            stats['lines_removed'] += len(chars)
+    dmp.diff_charsToLines(line_diff, lines)
+    for change_type, text in refine_hunks(dmp, line_diff):
+        if change_type == dmp.DIFF_INSERT:
+            stats['chars_added'] += len(text)
+        elif change_type == dmp.DIFF_DELETE:
+            stats['chars_removed'] += len(text)
+    return stats
+
+
+def make_delta(base_text, text):
+    """
+    Return the diff_match_patch patch (in its text form) turning base_text into text.
+
+    :return: the patch, or None if it's no smaller than text or it doesn't reproduce text exactly
+    """
+    dmp = diff_match_patch.diff_match_patch()
+    dmp.Diff_Timeout = settings.DIFF_TIMEOUT
+    delta = dmp.patch_toText(dmp.patch_make(base_text, hunked_diff(dmp, base_text, text)))
+    if len(delta) >= len(text) or apply_delta(base_text, delta) != text:
+        return None
+    return delta
+
+
+def apply_delta(base_text, delta):
+    """
+    Apply a patch made by make_delta to the text it was made against.
+    """
+    dmp = diff_match_patch.diff_match_patch()
+    text, results = dmp.patch_apply(dmp.patch_fromText(delta), base_text)
+    if not all(results):
+        raise ValueError('The patch does not apply to the text')
+    return text
+
+
 def side_by_side_diff(old_text, new_text):
     """
     Calculates a side-by-side line-based difference view.
@@ -28,9 +117,9 @@ def side_by_side_diff(old_text, new_text):
 
     line_split = re.compile(r'(?:\r?\n)')
     dmp = diff_match_patch.diff_match_patch()
+    dmp.Diff_Timeout = settings.DIFF_TIMEOUT
 
-    diff = dmp.diff_main(old_text, new_text)
-    dmp.diff_cleanupSemantic(diff)
+    diff = hunked_diff(dmp, old_text, new_text)
 
     open_entry = ([None], [None])
     for change_type, entry in diff:
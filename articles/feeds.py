@@ -1,8 +1,18 @@
-from django.contrib.syndication.views import Feed
+import copy
+import itertools
+from StringIO import StringIO
+from django.conf import settings
+from django.contrib.sites.models import get_current_site
+from django.contrib.syndication.views import Feed, add_domain
+from django.core.exceptions import ObjectDoesNotExist
 from django.core.urlresolvers import reverse
+from django.db.models import Max
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.utils.feedgenerator import Rss201rev2Feed
-from articles.models import Article
+from django.utils.xmlutils import SimplerXMLGenerator
+from articles.conditional import conditional_view, make_etag
+from articles.models import Article, Revision
 from tags.models import Tag
 
 
@@ -12,21 +22,127 @@ class DevCharmFeed(Rss201rev2Feed):
         handler.addQuickElement('authorLink', item['author_link'])
         handler.addQuickElement('author', item['author_name'])
 
+    def stream(self, items, encoding):
+        """
+        Generate the feed in chunks, writing the items (dicts of add_item keyword arguments) as they come.
+
+        Each item is dropped as soon as it's written, so that memory doesn't grow with the length of the feed. Items
+        are expected newest first: the first one dates the channel.
+        """
+        outfile = StringIO()
+        handler = SimplerXMLGenerator(outfile, encoding)
+
+        def flush():
+            chunk = outfile.getvalue()
+            outfile.seek(0)
+            outfile.truncate()
+            return chunk
+
+        items = iter(items)
+        first = next(items, None)
+        if first is not None:
+            items = itertools.chain([first], items)
+            self.add_item(**first)  # For latest_post_date()
+        handler.startDocument()
+        handler.startElement('rss', self.rss_attributes())
+        handler.startElement('channel', self.root_attributes())
+        self.add_root_elements(handler)
+        yield flush()
+        for item in items:
+            self.items = []
+            self.add_item(**item)
+            self.write_items(handler)
+            yield flush()
+        self.items = []
+        self.endChannelElement(handler)
+        handler.endElement('rss')
+        yield flush()
+
+
+class StreamingFeed(Feed):
+    """
+    A Feed streamed to the client, reading at most get_item_limit() of its items from the database one at a time;
+    subclasses set item_limit, or override get_item_limit() for limits that vary with the request.
+
+    Only the item attributes the devcharm feeds use are supported: title, link, description, pubdate, author_name and
+    author_link, which are all expected to be methods taking the item.
+    """
+    feed_type = DevCharmFeed
+    item_limit = 50
+
+    def get_item_limit(self):
+        return self.item_limit
 
-class ArticleFeedByTag(Feed):
+    def __call__(self, request, *args, **kwargs):
+        try:
+            obj = self.get_object(request, *args, **kwargs)
+        except ObjectDoesNotExist:
+            raise Http404('Feed object does not exist.')
+        site = get_current_site(request)
+        feed = self.feed_type(
+            title=self.title(obj),
+            link=add_domain(site.domain, self.link(obj), request.is_secure()),
+            description=self.description(obj),
+            feed_url=add_domain(site.domain, request.path, request.is_secure()),
+            language=settings.LANGUAGE_CODE,
+        )
+        items = self.items(obj)[:self.get_item_limit()].iterator()
+        item_kwargs = (self.get_item_kwargs(item, site, request) for item in items)
+        return StreamingHttpResponse(feed.stream(item_kwargs, 'utf-8'), content_type=feed.mime_type)
+
+    def get_item_kwargs(self, item, site, request):
+        link = add_domain(site.domain, self.item_link(item), request.is_secure())
+        return {
+            'title': self.item_title(item),
+            'link': link,
+            'unique_id': link,
+            'description': self.item_description(item),
+            'pubdate': self.item_pubdate(item),
+            'author_name': self.item_author_name(item),
+            'author_link': self.item_author_link(item),
+        }
+
+
+class ArticleFeedByTag(StreamingFeed):
+    item_limit = settings.FEED_NUM_ARTICLES
     request = None
-    feed_type = DevCharmFeed
+    author_links = None
 
     def __call__(self, request, *args, **kwargs):
-        self.request = request
-        return super(ArticleFeedByTag, self).__call__(request, *args, **kwargs)
+        # The items are streamed after this returns, so each request gets its own copy of the (shared) feed
+        feed = copy.copy(self)
+        feed.request, feed.author_links = request, {}
+        etag, last_modified = feed.get_validators(*args, **kwargs)
+        view = conditional_view(super(ArticleFeedByTag, feed).__call__, etag, last_modified)
+        return view(request, *args, **kwargs)
+
+    def get_validators(self, tag=None, *args, **kwargs):
+        """
+        Return the ETag and Last-Modified values of the feed.
+
+        The ETag comes from the items themselves (along with their authors' names), so that it changes whenever one
+        drops out of the feed; Last-Modified from their latest publication and edit, and from the latest edit of any
+        article with the tag, which takes in the ones unpublished or deleted since.
+        """
+        articles = Article.all_objects.all()
+        if tag is not None:
+            articles = articles.filter(tags__title=tag)
+        items = list(articles.filter(published_at__isnull=False, deleted_at__isnull=True)
+                     .order_by('-published_at')[:self.get_item_limit()]
+                     .values_list('pk', 'published_at', 'updated_at', 'author__username',
+                                  'author__author_profile__display_name'))
+        if not items:
+            return None, None  # Nothing to compare against, or a 404 to come
+        dates = [item[1] for item in items] + [item[2] for item in items]
+        dates.append(articles.aggregate(updated_at=Max('updated_at'))['updated_at'])
+        return make_etag(tag, items), max(date for date in dates if date is not None)
 
     def get_object(self, request, tag=None, *args, **kwargs):
         return get_object_or_404(Tag, title=tag)
 
     def items(self, obj):
-        return Article.objects.filter(tags=obj, published_at__isnull=False)\
-            .select_related('author', 'author__author').order_by('-published_at')
+        return Article.objects.filter(tags=obj, published_at__isnull=False).for_listing()\
+            .select_related('author__author_profile').order_by('-published_at')
 
     def link(self, obj):
         if obj:
@@ -53,7 +169,11 @@ class ArticleFeedByTag(Feed):
         return item.author.author_profile.display_name
 
     def item_author_link(self, item):
-        return self.request.build_absolute_uri(item.author.author_profile.get_absolute_url())
+        # Authors tend to have many items in a feed, and building their link takes a reverse()
+        if item.author_id not in self.author_links:
+            url = item.author.author_profile.get_absolute_url()
+            self.author_links[item.author_id] = self.request.build_absolute_uri(url)
+        return self.author_links[item.author_id]
 
 
 class ArticleFeedGlobal(ArticleFeedByTag):
@@ -62,11 +182,21 @@ class ArticleFeedGlobal(ArticleFeedByTag):
 
 
 class RevisionFeed(ArticleFeedByTag):
+    item_limit = settings.FEED_NUM_REVISIONS
+
+    def get_validators(self, pk=None, *args, **kwargs):
+        latest = Revision.objects.filter(
+            article__in=Article.objects.get_queryset_for_user(self.request.user).filter(pk=pk)
+        ).aggregate(pk=Max('pk'), created_at=Max('created_at'))
+        if latest['pk'] is None:
+            return None, None
+        return make_etag(pk, latest['pk']), latest['created_at']
+
     def get_object(self, request, pk=None, *args, **kwargs):
         return get_object_or_404(Article.objects.get_queryset_for_user(self.request.user), pk=pk)
 
     def items(self, obj):
-        return obj.revision_set.select_related('author', 'author__author').order_by('-pk')
+        return obj.revision_set.select_related('author__author_profile').order_by('-pk')
 
     def link(self, obj):
         return reverse('articles_article_revision_feed', kwargs={'pk': obj.pk, 'slug': obj.slug})
@@ -75,7 +205,7 @@ class RevisionFeed(ArticleFeedByTag):
         return u'New revisions for "{}"'.format(obj.title)
 
     def item_link(self, item):
-        return reverse('articles_article_revision_detail', kwargs={'pk': item.article.pk, 'revision_id': item.pk})
+        return reverse('articles_article_revision_detail', kwargs={'pk': item.article_id, 'revision_id': item.pk})
 
     def item_pubdate(self, item):
         return item.created_at
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from multiprocessing import Pool, cpu_count
+from optparse import make_option
+import operator
+from django.core.management.base import NoArgsCommand
+from django.db import connection
+from django.db.models import Q
+from articles.models import Revision, REVISION_CHANGE_STATS_FIELDS
+
+
+def backfill_article(task):
+    """
+    Work out the change stats of the revisions of an article that miss them (or of all of them, with recompute).
+
+    The history is gone through oldest first, so that every revision is rebuilt once and every keyframe loaded once.
+
+    :param task: tuple of (article id, recompute)
+    :return: the number of revisions updated
+    """
+    article_id, recompute = task
+    revisions = Revision.objects.filter(article=article_id).order_by('pk')\
+        .only('article', 'stored_content', 'keyframe', *REVISION_CHANGE_STATS_FIELDS)
+    keyframes, previous, updated = {}, None, 0
+    for revision in revisions.iterator():
+        revision.get_raw_content(keyframes.get(revision.keyframe_id))
+        if revision.keyframe_id is None:
+            keyframes[revision.pk] = revision.stored_content
+        if recompute or any(getattr(revision, field) is None for field in REVISION_CHANGE_STATS_FIELDS):
+            revision.compute_change_stats(previous)
+            Revision.objects.filter(pk=revision.pk)\
+                .update(**dict((field, getattr(revision, field)) for field in REVISION_CHANGE_STATS_FIELDS))
+            updated += 1
+        previous = revision
+    return updated
+
+
+class Command(NoArgsCommand):
+    help = 'Works out the change stats of the revisions created before they were stored, article by article, ' \
+           'spreading the articles over a pool of processes.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--processes', type='int', default=cpu_count(),
+                    help='How many processes to work with; 1 does everything in this process (default: the number of '
+                         'CPUs)'),
+        make_option('--batch-size', type='int', default=100,
+                    help='How many articles to hand out to the processes at a time (default: 100)'),
+        make_option('--recompute', action='store_true', default=False,
+                    help='Work out the stats of every revision again, not just of the ones missing them'),
+    )
+
+    def handle_noargs(self, **options):
+        revisions = Revision.objects.all()
+        if not options['recompute']:
+            revisions = revisions.filter(reduce(operator.or_, [Q(**{field + '__isnull': True})
+                                                               for field in REVISION_CHANGE_STATS_FIELDS]))
+        # Only the ids are read, a chunk at a time and each once, rather than a row for every revision
+        article_ids = revisions.order_by('article').values_list('article', flat=True).distinct()
+        total = article_ids.count()
+        batch_size = max(options['batch_size'], 1)
+
+        pool = None
+        if options['processes'] > 1:
+            # The processes are forked with a copy of the connection, which they can't share: each opens its own
+            connection.close()
+            pool = Pool(options['processes'])
+        updated = done = 0
+        try:
+            batch = list(article_ids[:batch_size])
+            while batch:
+                tasks = [(article_id, options['recompute']) for article_id in batch]
+                updated += sum(pool.map(backfill_article, tasks) if pool else map(backfill_article, tasks))
+                done += len(batch)
+                self.stdout.write('{} of {} articles done, {} revisions updated'.format(done, total, updated))
+                # Going on from the last id, since the articles done may not match the filter anymore
+                batch = list(article_ids.filter(article__gt=batch[-1])[:batch_size])
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+        self.stdout.write('Updated the change stats of {} revisions of {} articles'.format(updated, done))
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import NoArgsCommand
+from django.test.utils import override_settings
+from optparse import make_option
+import time
+from articles.models import Article
+from tags.postings import TagPostings
+
+
+class Command(NoArgsCommand):
+    help = 'Times tag page queries as the drilldown grows from 1 to 6 tags, comparing one join per tag, a single ' \
+           'intersection subquery, and the tag postings index used by the tag pages.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--repeat', type='int', default=20, help='How many times to run each query (default: 20)'),
+        make_option('--page-size', type='int', default=20, help='How many articles to fetch (default: 20)'),
+    )
+
+    def joined_queryset(self, titles):
+        qs = Article.objects.get_queryset_for_user()
+        for title in titles:
+            qs = qs.filter(tags__title=title)
+        return Article.objects.sorted_by_hot(qs)
+
+    def intersection_queryset(self, titles):
+        pks = Article.objects_as_tagged.tagged_with_all_pks(titles)
+        return Article.objects.sorted_by_hot(Article.objects.get_queryset_for_user().filter(pk__in=pks))
+
+    def index_queryset(self, titles):
+        pks = Article.objects_as_tagged.tagged_with_all_ids(titles)
+        return Article.objects.sorted_by_hot(Article.objects.get_queryset_for_user().filter(pk__in=pks))
+
+    def time_queryset(self, build_queryset, titles, repeat, page_size):
+        start = time.time()
+        for _ in range(repeat):
+            list(build_queryset(titles).values_list('pk', flat=True)[:page_size])
+        return (time.time() - start) * 1000 / repeat
+
+    def handle_noargs(self, **options):
+        repeat, page_size = options['repeat'], options['page_size']
+        # The most used tags are the worst case for every strategy
+        titles = [tag.title for tag in Article.objects_as_tagged.get_tags_by_count()[:6]]
+        if not titles:
+            self.stdout.write('There are no tagged articles to benchmark')
+            return
+        TagPostings.for_model(Article).rebuild()  # Tag pages start rebuilding it in the background, instead
+        self.stdout.write('depth  joins (ms)  intersection (ms)  index (ms)')
+        # The index is used here even where it's turned off for lack of a shared cache, since it's all one process
+        with override_settings(TAG_POSTINGS_ENABLED=True):
+            for depth in range(1, len(titles) + 1):
+                joined = self.time_queryset(self.joined_queryset, titles[:depth], repeat, page_size)
+                intersection = self.time_queryset(self.intersection_queryset, titles[:depth], repeat, page_size)
+                index = self.time_queryset(self.index_queryset, titles[:depth], repeat, page_size)
+                self.stdout.write('{:>5}  {:>10.2f}  {:>17.2f}  {:>10.2f}'.format(depth, joined, intersection,
+                                                                                 index))
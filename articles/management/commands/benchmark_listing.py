@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.client import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from articles.models import Article
+
+
+class Command(BaseCommand):
+    args = '[path ...]'
+    help = 'Measures the bytes read from the database to render pages with article lists (the homepage by default), ' \
+           'loading every column and deferring the ones article lists leave out (see ArticleQuerySet.for_listing).'
+
+    def value_size(self, value):
+        if isinstance(value, unicode):
+            return len(value.encode('utf-8'))
+        if isinstance(value, str):
+            return len(value)
+        return 8  # Numbers, dates and the like are close enough
+
+    def measure(self, path):
+        """
+        Render the page with all caches missed, then run its queries again to add up the size of the rows they return.
+        """
+        Article.objects.invalidate_page_cache()
+        with CaptureQueriesContext(connection) as queries:
+            response = Client().get(path)
+        if response.status_code != 200:
+            raise CommandError('{} answered with a {}'.format(path, response.status_code))
+        cursor = connection.cursor()
+        total = 0
+        for query in queries.captured_queries:
+            if not query['sql'].lstrip().upper().startswith('SELECT'):
+                continue
+            cursor.execute(query['sql'])
+            total += sum(self.value_size(value) for row in cursor.fetchall() for value in row)
+        return len(queries), total
+
+    def handle(self, *paths, **options):
+        self.stdout.write('path                            queries  all columns (bytes)  for_listing (bytes)  saved')
+        for path in paths or ['/']:
+            self.measure(path)  # Warming up the caches that outlive the page cache, like the trending tags
+            with override_settings(ARTICLE_LISTING_DEFERRED_FIELDS=[]):
+                queries, full = self.measure(path)
+            listing_queries, listing = self.measure(path)
+            saved = 100.0 * (full - listing) / full if full else 0
+            self.stdout.write('{:<30}  {:>7}  {:>19}  {:>19}  {:>4.0f}%'.format(path, listing_queries, full, listing,
+                                                                            saved))
+            if listing_queries > queries:
+                self.stdout.write('  (loading deferred columns took {} more queries)'.format(listing_queries - queries))
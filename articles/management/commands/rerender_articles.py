@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import NoArgsCommand
+from django.db.transaction import atomic
+from articles.models import Article, Revision, REVISION_FIELDS
+
+# The fields of articles and revisions that are rendered from the raw content
+RENDERED_ARTICLE_FIELDS = ['title', 'description', 'punchline', 'rendered_html']
+RENDERED_REVISION_FIELDS = ['title', 'description', 'punchline']
+
+
+def render_fields(raw_content, fields):
+    data = Article.process_raw_content(raw_content)
+    # Empty values are left alone, as Article.update_from_raw_content() does
+    return dict((field, data[field]) for field in fields if data[field])
+
+
+@atomic
+def rerender_article(article_id, raw_content):
+    """
+    Render the fields of an article and of its revisions again from their raw content.
+
+    The content hashes of the revisions are worked out again too, so that saving an article with unchanged content
+    still finds its revision.
+
+    :return: the number of revisions updated
+    """
+    Article.all_objects.filter(pk=article_id).update(**render_fields(raw_content, RENDERED_ARTICLE_FIELDS))
+    revisions = Revision.objects.filter(article=article_id).order_by('pk')\
+        .only('article', 'stored_content', 'keyframe', *RENDERED_REVISION_FIELDS)
+    keyframes, updated = {}, 0
+    for revision in revisions.iterator():
+        revision.get_raw_content(keyframes.get(revision.keyframe_id))
+        if revision.keyframe_id is None:
+            keyframes[revision.pk] = revision.stored_content
+        values = render_fields(revision.raw_content, RENDERED_REVISION_FIELDS)
+        for field, value in values.items():
+            setattr(revision, field, value)
+        values['content_hash'] = Revision.compute_content_hash(
+            dict((field, getattr(revision, field)) for field in REVISION_FIELDS))
+        Revision.objects.filter(pk=revision.pk).update(**values)
+        updated += 1
+    return updated
+
+
+class Command(NoArgsCommand):
+    help = 'Renders the title, description, punchline and HTML of every article and revision again from their raw ' \
+           'content, to bring the stored values in line with the current renderer.'
+
+    def handle_noargs(self, **options):
+        articles = Article.all_objects.order_by('pk').values_list('pk', 'raw_content')
+        done = updated = 0
+        for article_id, raw_content in articles.iterator():
+            updated += rerender_article(article_id, raw_content)
+            done += 1
+        self.stdout.write('Rendered {} articles and {} revisions again'.format(done, updated))
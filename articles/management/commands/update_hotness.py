@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import NoArgsCommand
+from articles.models import Article
+
+
+class Command(NoArgsCommand):
+    help = 'Recomputes the materialized hotness of published articles; meant to be run periodically to apply decay.'
+
+    def handle_noargs(self, **options):
+        updated = Article.all_objects.update_hotness()
+        self.stdout.write('Updated hotness for {} articles'.format(updated))
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from optparse import make_option
+from django.conf import settings
+from django.core.management.base import CommandError, NoArgsCommand
+from articles.models import Article
+
+
+class Command(NoArgsCommand):
+    help = 'Recomputes the cached trending tags; meant to be run more often than TRENDING_TAGS_CACHE_TIMEOUT, and ' \
+           'every minute or so with --if-stale to pick up kudos and publications.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--if-stale', action='store_true', default=False,
+                    help='Only recompute the trending tags if kudos or publications may have changed them'),
+    )
+
+    def handle_noargs(self, **options):
+        if not settings.TRENDING_TAGS_WARMING_ENABLED:
+            raise CommandError('Warming the trending tags needs a cache shared with the web processes; set it up and '
+                               'turn on TRENDING_TAGS_WARMING_ENABLED')
+        if options['if_stale'] and not Article.objects.trending_tags_are_stale():
+            self.stdout.write('The trending tags are up to date')
+            return
+        tags = Article.objects.refresh_trending_tags()
+        self.stdout.write('Cached {} trending tags'.format(len(tags)))
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+import hashlib
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import DataMigration
+from django.db import models
+from django.utils.encoding import force_text
+import diff_match_patch
+from markdown import Markdown
+from markdown.extensions import Extension
+from markdown.treeprocessors import Treeprocessor
+
+
+# Frozen copies of KEYFRAME_INTERVAL and DIFF_TIMEOUT, and of the functions in articles.diff and
+# articles.rendering this migration needs, so later changes to them don't affect it
+KEYFRAME_INTERVAL = 20
+DIFF_TIMEOUT = 1.0
+
+
+def compute_content_hash(revision, fields):
+    text = u'\0'.join(force_text(getattr(revision, field) or u'') for field in fields)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def hunked_diff(dmp, old_text, new_text):
+    old_chars, new_chars, lines = dmp.diff_linesToChars(old_text, new_text)
+    line_diff = dmp.diff_main(old_chars, new_chars, False)
+    dmp.diff_charsToLines(line_diff, lines)
+    diff = []
+    deleted, inserted = [], []
+    for change_type, text in line_diff + [(dmp.DIFF_EQUAL, '')]:
+        if change_type == dmp.DIFF_DELETE:
+            deleted.append(text)
+        elif change_type == dmp.DIFF_INSERT:
+            inserted.append(text)
+        else:
+            if deleted or inserted:
+                hunk = dmp.diff_main(''.join(deleted), ''.join(inserted), False)
+                dmp.diff_cleanupSemantic(hunk)
+                diff.extend(hunk)
+                deleted, inserted = [], []
+            if text:
+                diff.append((change_type, text))
+    return diff
+
+
+def make_delta(base_text, text):
+    dmp = diff_match_patch.diff_match_patch()
+    dmp.Diff_Timeout = DIFF_TIMEOUT
+    delta = dmp.patch_toText(dmp.patch_make(base_text, hunked_diff(dmp, base_text, text)))
+    if len(delta) >= len(text) or apply_delta(base_text, delta) != text:
+        return None
+    return delta
+
+
+def apply_delta(base_text, delta):
+    dmp = diff_match_patch.diff_match_patch()
+    text, results = dmp.patch_apply(dmp.patch_fromText(delta), base_text)
+    if not all(results):
+        raise ValueError('The patch does not apply to the text')
+    return text
+
+
+class ArticleTreeprocessor(Treeprocessor):
+    def run(self, root):
+        self.markdown.article_tree = root
+
+
+class ArticleExtension(Extension):
+    def extendMarkdown(self, md, md_globals):
+        md.article_tree = None
+        md.treeprocessors.add('article', ArticleTreeprocessor(md), '_end')
+
+
+def postprocess(md, html):
+    for postprocessor in md.postprocessors.values():
+        html = postprocessor.run(html)
+    return html
+
+
+def extract(parents, element):
+    parent = parents[element]
+    index = list(parent).index(element)
+    if element.tail:
+        if index:
+            parent[index - 1].tail = (parent[index - 1].tail or '') + element.tail
+        else:
+            parent.text = (parent.text or '') + element.tail
+    parent.remove(element)
+
+
+def render_html(raw_content):
+    """
+    Render the article content, less its title (the first h1), punchline (the first blockquote) and description (the
+    last paragraph before the first h2).
+    """
+    md = Markdown(extensions=[ArticleExtension()])
+    md.convert(raw_content)
+    root = md.article_tree
+    if root is None:
+        return ''
+    if root.text and not root.text.strip():
+        root.text = None
+    if len(root) and root[-1].tail and not root[-1].tail.strip():
+        root[-1].tail = None
+    parents = dict((child, parent) for parent in root.iter() for child in parent)
+    for tag in ['h1', 'blockquote']:
+        element = next(root.iter(tag), None)
+        if element is not None:
+            extract(parents, element)
+    description = None
+    for element in root.iter():
+        if element.tag == 'h2':
+            break
+        if element.tag == 'p':
+            description = element
+    else:
+        description = None
+    if description is not None:
+        extract(parents, description)
+    html = md.serializer(root)
+    try:
+        html = html[html.index('<%s>' % md.doc_tag) + len(md.doc_tag) + 2:html.rindex('</%s>' % md.doc_tag)]
+    except ValueError:
+        html = ''
+    return postprocess(md, html)
+
+
+class Migration(DataMigration):
+    def forwards(self, orm):
+        """
+        Keep one revision every KEYFRAME_INTERVAL of each article as a keyframe, and store the others as
+        patches against the keyframe before them.
+
+        Content hashes are computed again too, since they no longer include the rendered HTML.
+        """
+        for revisions in self.revisions_by_article(orm):
+            keyframe = None
+            for revision in revisions:
+                revision.raw_content = revision.stored_content
+                revision.content_hash = compute_content_hash(revision, ['title', 'description', 'punchline',
+                                                                        'raw_content'])
+                delta = None
+                if keyframe is not None and deltas_count < KEYFRAME_INTERVAL - 1:
+                    delta = make_delta(keyframe.stored_content, revision.stored_content)
+                if delta is None:
+                    keyframe, deltas_count = revision, 0
+                else:
+                    revision.stored_content, revision.keyframe_id = delta, keyframe.pk
+                    deltas_count += 1
+                orm['articles.revision'].objects.filter(pk=revision.pk).update(
+                    stored_content=revision.stored_content, keyframe=revision.keyframe_id,
+                    content_hash=revision.content_hash)
+
+    def backwards(self, orm):
+        for revisions in self.revisions_by_article(orm):
+            keyframe = None
+            for revision in revisions:
+                if revision.keyframe_id is None:
+                    keyframe = revision
+                else:
+                    if keyframe is None or keyframe.pk != revision.keyframe_id:
+                        keyframe = orm['articles.revision'].objects.get(pk=revision.keyframe_id)
+                    revision.stored_content = apply_delta(keyframe.stored_content, revision.stored_content)
+                revision.raw_content = revision.stored_content
+                revision.rendered_html = render_html(revision.raw_content)
+                revision.content_hash = compute_content_hash(revision, ['title', 'description', 'punchline',
+                                                                        'raw_content', 'rendered_html'])
+                orm['articles.revision'].objects.filter(pk=revision.pk).update(
+                    stored_content=revision.stored_content, keyframe=None, rendered_html=revision.rendered_html,
+                    content_hash=revision.content_hash)
+
+    def revisions_by_article(self, orm):
+        """
+        Yield the revisions of each article in turn, oldest first, so that only one article is ever loaded at once.
+        """
+        article_ids = orm['articles.revision'].objects.order_by('article').values_list('article', flat=True).distinct()
+        for article_id in article_ids:
+            yield orm['articles.revision'].objects.filter(article=article_id).order_by('pk')
+
+    models = {
+        u'articles.article': {
+            'Meta': {'object_name': 'Article', 'index_together': "[['hotness', 'id'], ['published_at', 'id'], ['updated_at', 'id'], ['views_count', 'id'], ['received_kudos_count', 'id']]"},
+            'author': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['auth.User']"}),
+            'comments_count': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'deleted_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'description': ('django.db.models.fields.TextField', [], {}),
+            'editors_count': ('django.db.models.fields.PositiveIntegerField', [], {'default': '1'}),
+            'hide': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'hotness': ('django.db.models.fields.FloatField', [], {'default': '0', 'db_index': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_wiki': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'keywords': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'links_count': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'original_author': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'created_articles'", 'null': 'True', 'to': u"orm['auth.User']"}),
+            'published_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'punchline': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'raw_content': ('django.db.models.fields.TextField', [], {}),
+            'received_kudos_count': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'rendered_html': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'revisions_count': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'slug': ('django.db.models.fields.SlugField', [], {'max_length': '255'}),
+            'submitted_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'tags': ('django.db.models.fields.related.ManyToManyField', [], {'blank': 'True', 'related_name': "'tagged_article_set'", 'null': 'True', 'symmetrical': 'False', 'to': u"orm['tags.Tag']"}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'updated_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'views_count': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'})
+        },
+        u'articles.articlecontributor': {
+            'Meta': {'unique_together': "[['article', 'user']]", 'object_name': 'ArticleContributor'},
+            'article': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['articles.Article']"}),
+            'edits_count': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'first_edit_at': ('django.db.models.fields.DateTimeField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_edit_at': ('django.db.models.fields.DateTimeField', [], {}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['auth.User']"})
+        },
+        u'articles.articlegroup': {
+            'Meta': {'object_name': 'ArticleGroup'},
+            'articles': ('django.db.models.fields.related.ManyToManyField', [], {'symmetrical': 'False', 'to': u"orm['articles.Article']", 'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'publish_start': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'target_block': ('django.db.models.fields.CharField', [], {'default': "'editors_picks'", 'max_length': '255'})
+        },
+        u'articles.articleview': {
+            'Meta': {'object_name': 'ArticleView'},
+            'article': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['articles.Article']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'session_id': ('django.db.models.fields.CharField', [], {'max_length': '32'}),
+            'timestamp': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'viewed_pages'", 'null': 'True', 'to': u"orm['auth.User']"})
+        },
+        u'articles.kudos': {
+            'Meta': {'unique_together': "[('article', 'session_id'), ('article', 'user')]", 'object_name': 'Kudos'},
+            'article': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'kudos_received'", 'to': u"orm['articles.Article']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'session_id': ('django.db.models.fields.CharField', [], {'max_length': '32'}),
+            'timestamp': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'kudos_given'", 'null': 'True', 'to': u"orm['auth.User']"})
+        },
+        u'articles.revision': {
+            'Meta': {'ordering': "['-pk']", 'object_name': 'Revision', 'index_together': "[['article', 'content_hash']]"},
+            'article': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['articles.Article']"}),
+            'author': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['auth.User']"}),
+            'content_hash': ('django.db.models.fields.CharField', [], {'max_length': '40'}),
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'description': ('django.db.models.fields.TextField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'keyframe': ('django.db.models.fields.related.ForeignKey', [], {'default': 'None', 'related_name': "'deltas'", 'null': 'True', 'blank': 'True', 'to': u"orm['articles.Revision']"}),
+            'punchline': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'rendered_html': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'stored_content': ('django.db.models.fields.TextField', [], {'db_column': "'raw_content'"}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        },
+        u'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': u"orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        u'auth.permission': {
+            'Meta': {'ordering': "(u'content_type__app_label', u'content_type__model', u'codename')", 'unique_together': "((u'content_type', u'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['contenttypes.ContentType']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        u'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'symmetrical': 'False', 'related_name': "u'user_set'", 'blank': 'True', 'to': u"orm['auth.Group']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'symmetrical': 'False', 'related_name': "u'user_set'", 'blank': 'True', 'to': u"orm['auth.Permission']"}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        },
+        u'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        u'tags.tag': {
+            'Meta': {'object_name': 'Tag'},
+            'description': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'tag_type': ('django.db.models.fields.CharField', [], {'max_length': '32'}),
+            'title': ('django.db.models.fields.SlugField', [], {'unique': 'True', 'max_length': '50'}),
+            'updated': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'verbose_title': ('django.db.models.fields.CharField', [], {'max_length': '50', 'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['articles']
+    symmetrical = True
@@ -1,59 +1,236 @@
 # coding=utf-8
-from bs4 import BeautifulSoup
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
-from django.db import models, IntegrityError
+from django.db import models, IntegrityError, connection
 from django.db.models import permalink, F, Q
+from django.db.models.query import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_delete, m2m_changed
 from django.db.transaction import atomic
 from django.forms import model_to_dict
 from django.template.defaultfilters import striptags, slugify
+from django.utils.encoding import force_text
 from django.utils.timezone import now
 from datetime import timedelta
-from markdown import markdown
 import re
-from profiles.models import Author
+import time
+from articles.diff import apply_delta, count_changes, make_delta
+from articles.rendering import content_hash, rendered_content_cache, render_article_content
+from profiles.models import Author, batch_counters
 from scoring.models import ScoreTransaction
 from tags.models import Taggable, Tag
 
 
+# This is the decay function:
+# http://www.wolframalpha.com/input/?i=exp%28-0.05*x*x%29
+# I tried to keep a soft decay for the first week
+# It's a postgresql-compliant implementation, shared by the live annotation and the materialized hotness column
+HOTNESS_SQL = "select LOG((points+1) * EXP(-0.05 * days_ago * days_ago)) " \
+              "from " \
+              "(select LEAST(7, DATE_PART('day', DATE %s - published_at)) as days_ago) ttt, " \
+              "(select COUNT(*) as points from articles_kudos where " \
+              "article_id=articles_article.id AND timestamp>%s) ttt2"
+
+TRENDING_TAGS_CACHE_KEY = 'articles:trending_tags'
+# Set when kudos or publications may have changed the trending tags, until warm_trending_tags refreshes them
+TRENDING_TAGS_STALE_CACHE_KEY = 'articles:trending_tags:stale'
+# Related content indexes are keyed by a generation, which is bumped whenever tags or publication states change
+RELATED_CONTENT_GENERATION_CACHE_KEY = 'articles:related:generation'
+RELATED_CONTENT_CACHE_KEY = 'articles:related:{generation}:{pk}'
+# Cached pages and fragments are keyed by a generation too, which is bumped whenever any article content changes
+PAGE_CACHE_GENERATION_CACHE_KEY = 'articles:pages:generation'
+PAGE_CACHE_KEY = 'articles:pages:{generation}:{path}'
+# Side-by-side diffs of a revision against the article, by the hash of the article's current content: reverting to an
+# older version adds no revision, so the latest revision can't tell what the diff is against
+DIFF_CACHE_KEY = 'articles:diff:{revision_id}:{content_hash}'
+
+# The fields that make up a revision; two revisions with the same values are the same revision. The rendered HTML is
+# left out, since it follows from the raw content
+REVISION_FIELDS = ['title', 'description', 'punchline', 'raw_content']
+REVISION_CHANGE_STATS_FIELDS = ['lines_added', 'lines_removed', 'chars_added', 'chars_removed', 'links_added']
+
+
+class ArticleQuerySet(QuerySet):
+    def for_listing(self):
+        """
+        Defer the (large) columns that article lists don't show, as listed in ARTICLE_LISTING_DEFERRED_FIELDS.
+        """
+        return self.defer(*settings.ARTICLE_LISTING_DEFERRED_FIELDS)
+
+
 class ArticleManager(models.Manager):
-    def sorted_by_hot(self, qs=None, from_date=None):
-        # This is the decay function:
-        # http://www.wolframalpha.com/input/?i=exp%28-0.05*x*x%29
-        # I tried to keep a soft decay for the first week
+    def get_queryset(self):
+        return ArticleQuerySet(self.model, using=self._db)
 
+    def for_listing(self):
+        return self.get_queryset().for_listing()
+
+    def get_hotness_params(self, from_date=None):
         tz_now = now()
-        if qs is None:
-            qs = self.get_queryset()
         if not from_date:
             from_date = tz_now - timedelta(days=7)
+        return [tz_now.strftime('%Y-%m-%d'), from_date.strftime('%Y-%m-%d')]
+
+    def sorted_by_hot(self, qs=None, from_date=None):
+        """
+        Return the published articles sorted by hotness.
+
+        By default this relies on the materialized `hotness` column, which is kept up to date when articles are saved
+        or receive kudos, and periodically decayed by the `update_hotness` management command. Passing a custom
+        `from_date` computes the score on the fly instead (as `live_hotness`), since the materialized value only covers
+        the last week.
+        """
+        if qs is None:
+            qs = self.get_queryset()
+        qs = qs.exclude(published_at__isnull=True)
+        if from_date is None:
+            return qs.order_by('-hotness')
+        qs = qs.extra(select={'live_hotness': HOTNESS_SQL}, select_params=self.get_hotness_params(from_date))
+        return qs.distinct().order_by('-live_hotness')
+
+    def update_hotness(self, pks=None):
+        """
+        Recompute the materialized hotness for all the published articles, or only for the ones in `pks`.
+
+        :return: the number of updated articles
+        :rtype: int
+        """
+        sql = 'UPDATE articles_article SET hotness = ({}) WHERE published_at IS NOT NULL'.format(HOTNESS_SQL)
+        params = self.get_hotness_params()
+        if pks is not None:
+            pks = tuple(pks)
+            if not pks:
+                return 0
+            sql += ' AND id IN %s'
+            params.append(pks)
+        cursor = connection.cursor()
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+    def compute_trending_tags(self):
+        from_date = now() - timedelta(days=31)
+        items = self.sorted_by_hot(from_date=from_date).values_list('pk', 'live_hotness')
+        # We can't easily filter out non-hot articles in the queryset, hence the list comprehension
+        return list(Article.objects_as_tagged.get_tags_by_count([pk for pk, hotness in items if hotness > 0]))
+
+    def refresh_trending_tags(self):
+        # Cleared first, so that changes made while computing leave the tags stale
+        cache.delete(TRENDING_TAGS_STALE_CACHE_KEY)
+        tags = self.compute_trending_tags()
+        cache.set(TRENDING_TAGS_CACHE_KEY, tags, settings.TRENDING_TAGS_CACHE_TIMEOUT)
+        return tags
+
+    def mark_trending_tags_stale(self):
+        """
+        Record that the trending tags may have changed, without the cost of computing them in the request.
+        """
+        cache.set(TRENDING_TAGS_STALE_CACHE_KEY, True, None)
 
-        # qs = qs.filter(kudos_received__timestamp__gt=from_date)
-        # qs = qs.annotate(points=Count('kudos_received'))
-        # for article in qs:
-        #     daysago = (tz_now - article.published_at).total_seconds() / 86400
-        #     s = math.log(max(article.points, 1)) * math.exp(-0.05 * daysago * daysago)
-        #     article.hotness = s
-        # qs = sorted(qs, key=lambda r: r.hotness, reverse=True)
-        # return qs
-        # The following is a postgresql-compliant implementation of the above; it should be safely switchable
-        qs = qs.exclude(published_at__isnull=True).extra(select={
-            'hotness': "select LOG((points+1) * EXP(-0.05 * days_ago * days_ago)) "
-                       "from "
-                       "(select LEAST(7, DATE_PART('day', DATE %s - published_at)) as days_ago) ttt, "
-                       "(select COUNT(*) as points from articles_kudos where "
-                       "article_id=articles_article.id AND timestamp>%s) ttt2",
-        }, select_params=[tz_now.strftime('%Y-%m-%d'), from_date.strftime('%Y-%m-%d')])
-        return qs.distinct().order_by('-hotness')
+    def trending_tags_are_stale(self):
+        return bool(cache.get(TRENDING_TAGS_STALE_CACHE_KEY))
 
     def get_trending_tags(self):
-        tz_now = now()
-        from_date = tz_now - timedelta(days=31)
+        """
+        Return the cached list of trending tags, annotated with their uses_count.
+
+        The list is computed inline when the cache is cold. With TRENDING_TAGS_WARMING_ENABLED, the cache is meant to
+        be kept warm by the warm_trending_tags management command instead, run periodically (and often, with
+        --if-stale, to pick up kudos and publications).
+        """
+        tags = cache.get(TRENDING_TAGS_CACHE_KEY)
+        if tags is None:
+            tags = self.refresh_trending_tags()
+        return tags
+
+    def get_related_content_generation(self):
+        generation = cache.get(RELATED_CONTENT_GENERATION_CACHE_KEY)
+        if generation is None:
+            # Starting from the clock, so that indexes left over from before an eviction are never picked up again
+            cache.add(RELATED_CONTENT_GENERATION_CACHE_KEY, int(time.time() * 1000), None)
+            generation = cache.get(RELATED_CONTENT_GENERATION_CACHE_KEY)
+        return generation
+
+    def invalidate_related_content(self):
+        try:
+            cache.incr(RELATED_CONTENT_GENERATION_CACHE_KEY)
+        except ValueError:  # Not there anymore, so it's going to be reinitialized anyway
+            pass
+
+    def get_page_cache_generation(self):
+        generation = cache.get(PAGE_CACHE_GENERATION_CACHE_KEY)
+        if generation is None:
+            # Starting from the clock, so that pages left over from before an eviction are never picked up again
+            cache.add(PAGE_CACHE_GENERATION_CACHE_KEY, int(time.time() * 1000), None)
+            generation = cache.get(PAGE_CACHE_GENERATION_CACHE_KEY)
+        return generation
+
+    def invalidate_page_cache(self):
+        try:
+            cache.incr(PAGE_CACHE_GENERATION_CACHE_KEY)
+        except ValueError:  # Not there anymore, so it's going to be reinitialized anyway
+            pass
+
+    def compute_related_content(self, article):
+        """
+        Build the related content index for an article: the read more list, the two related tags and their articles.
 
-        items = self.sorted_by_hot(from_date=from_date)  # There's a minor difficulty here: we can't easily filter out non-hot articles
-        # unless we use the queryset variant, so a list comprehension is required
-        return Article.objects_as_tagged.get_tags_by_count([a.pk for a in items if a.hotness > 0])
+        Articles are stored as lists of pks, capped to settings.RELATED_CONTENT_INDEX_SIZE; only published articles
+        are taken into account, since the index is shared among all users.
+        """
+        index = {'read_more': [], 'related_tag_one': None, 'related_articles_one': [],
+                 'related_tag_two': None, 'related_articles_two': []}
+        main_tag = article.primary_tag
+        if main_tag is None:
+            return index
+        size = settings.RELATED_CONTENT_INDEX_SIZE
+        published = self.get_queryset().filter(published_at__isnull=False).order_by('-pk')
+        # Other articles with the same primary tag
+        read_more = published.filter(tags=main_tag).exclude(pk=article.pk)
+        index['read_more'] = list(read_more.values_list('pk', flat=True)[:size])
+        # related tags and articles depend on the main tag
+        primary_types = [t[0] for t in Tag.PRIMARY_TYPES]
+        alt_primary_related_tags = [tag for tag in main_tag.related()
+                                    if tag.tag_type != main_tag.tag_type and tag.tag_type in primary_types]
+        padding_tags = list(Article.objects_as_tagged.get_tags_by_count().exclude(pk=main_tag.pk).exclude(
+            pk__in=[tag.pk for tag in alt_primary_related_tags])[:2])
+        related_tags = (alt_primary_related_tags + padding_tags)[:2]
+        # Each list of related articles leaves out the ones already listed before it
+        excluded = [read_more]
+        for tag, suffix in zip(related_tags, ['one', 'two']):
+            related_articles = published.filter(tags=tag)
+            for qs in excluded:
+                related_articles = related_articles.exclude(pk__in=qs.values_list('pk', flat=True))
+            index['related_tag_' + suffix] = tag
+            index['related_articles_' + suffix] = list(related_articles.values_list('pk', flat=True)[:size])
+            excluded.append(related_articles)
+        return index
+
+    def get_related_content(self, article):
+        """
+        Return the related content for an article, ready for the detail page context.
+
+        The index is cached until tags or publication states change, so this usually costs a cache lookup and a
+        single query for the articles.
+        """
+        key = RELATED_CONTENT_CACHE_KEY.format(generation=self.get_related_content_generation(), pk=article.pk)
+        index = cache.get(key)
+        if index is None:
+            index = self.compute_related_content(article)
+            cache.set(key, index, settings.RELATED_CONTENT_CACHE_TIMEOUT)
+        lists = ['read_more', 'related_articles_one', 'related_articles_two']
+        pks = set(pk for name in lists for pk in index[name])
+        articles = {}
+        if pks:
+            # Loading what the article widgets show, as get_queryset_for_user() does for the other lists
+            articles = self.get_queryset().filter(published_at__isnull=False).for_listing()\
+                .select_related('original_author__author_profile').prefetch_related('tags', 'articlegroup_set')\
+                .in_bulk(pks)
+        content = dict(index)
+        for name in lists:
+            # Articles which went away since the index was built are simply skipped
+            content[name] = [articles[pk] for pk in index[name] if pk in articles]
+        return content
 
     def get_wip_articles(self):
         return self.get_queryset().filter(tags__title=Tag.WIP_TAG)
@@ -119,13 +296,42 @@ class Article(Taggable, models.Model):
 
     keywords = models.TextField(blank=True, null=True)
 
+    # Materialized output of HOTNESS_SQL, see ArticleManager.update_hotness()
+    hotness = models.FloatField(default=0, db_index=True, editable=False)
+
     all_objects = ArticleManager()  # Full version with all articles, positioned as default manager (for the admin)
     objects = NonDeletedArticleManager()  # This one does not show the articles with deleted_at != None
     # frontpage = FrontpageManager()
 
+    class Meta:
+        # One for each sort order of the article lists, which are paginated by keyset on (sort key, id)
+        index_together = [
+            ['hotness', 'id'],
+            ['published_at', 'id'],
+            ['updated_at', 'id'],
+            ['views_count', 'id'],
+            ['received_kudos_count', 'id'],
+        ]
+
+    def __init__(self, *args, **kwargs):
+        super(Article, self).__init__(*args, **kwargs)
+        self._was_published = self.is_published
+        self._was_counted_as_published = self.counts_as_published
+
     def __unicode__(self):
         return self.title
 
+    def __eq__(self, other):
+        # Django compares classes, but articles from for_listing() are of a deferred subclass: compare models instead
+        if not isinstance(other, models.Model) or self._meta.concrete_model != other._meta.concrete_model:
+            return False
+        if self.pk is None:
+            return self is other
+        return self.pk == other.pk
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
     def update_from_raw_content(self):
         data = Article.process_raw_content(self.raw_content)
         data.pop('raw_content', None)
@@ -133,16 +339,19 @@ class Article(Taggable, models.Model):
             if value:  # At the moment, I can't see a reason to blanking out values
                 setattr(self, key, value)
 
-    @atomic
+    @batch_counters
     def save(self, *args, **kwargs):
         existing = False
+        adding = self._state.adding  # Values loaded in __init__ are meaningless for new instances
+        was_published = self._was_published and not adding
+        was_counted_as_published = self._was_counted_as_published and not adding
         self.update_from_raw_content()
-        revision_data = model_to_dict(self, ['title', 'description', 'punchline', 'raw_content', 'rendered_html'])
+        revision_data = model_to_dict(self, REVISION_FIELDS)
         if self.pk:  # We're updating an instance, so we should check for "fake" revisions
-            existing = self.revision_set.filter(**revision_data).exists()
+            existing = self.revision_set.filter(content_hash=Revision.compute_content_hash(revision_data)).exists()
             if not existing:
                 self.revisions_count += 1
-            other_editors = self.revision_set.exclude(author=self.author).values_list('author_id').distinct().count()
+            other_editors = self.articlecontributor_set.exclude(user=self.author).count()
             self.editors_count = other_editors + 1  # Current editor
             # If the instance has a PK, we'll also ensure wiki+WIP consistency
             if not self.is_wiki:
@@ -151,62 +360,78 @@ class Article(Taggable, models.Model):
             self.original_author = self.author
         self.slug = slugify(self.title)
         self.links_count = self.count_own_links()
+        self.updated_at = now()
         super(Article, self).save(*args, **kwargs)
-        published_count = self.original_author.created_articles.filter(published_at__isnull=False).count()
-        self.original_author.author_profile.articles_published_count = published_count
-        self.original_author.author_profile.save()
+        if self.is_published:
+            Article.all_objects.update_hotness([self.pk])
+            if not was_published:
+                Article.objects.mark_trending_tags_stale()
+        if self.counts_as_published != was_counted_as_published:
+            Article.objects.invalidate_related_content()
+            if not adding:  # New articles have no tags yet
+                self.record_tag_cooccurrences(1 if self.counts_as_published else -1)
+            self.original_author.author_profile.update_counters(
+                articles_published_count=1 if self.counts_as_published else -1)
+        if self.counts_as_published or was_counted_as_published:  # Drafts aren't in any of the cached pages
+            Article.objects.invalidate_page_cache()
+        self._was_published = self.is_published
+        self._was_counted_as_published = self.counts_as_published
         if not existing:
             revision_data['author'] = self.author  # Needed to avoid complaints about the FK not being an instance
-            self.revision_set.create(**revision_data)
-            self.author.author_profile.edits_count += 1
-            self.author.author_profile.save()
+            revision = self.revision_set.create(**revision_data)
+            ArticleContributor.objects.record_edit(revision)
+            self.author.author_profile.update_counters(edits_count=1)
 
     @property
     def other_contributors(self):
-        return self.all_contributors().exclude(pk=self.original_author.pk)
+        return self.all_contributors.exclude(pk=self.original_author_id)
 
     @property
     def all_contributors(self):
         """
-        Return all users who contributed an edit to the article, sorted by oldest revision first.
+        Return all users who contributed an edit to the article, sorted by their first edit.
 
         :return: :rtype: User queryset
         """
         return get_user_model().objects.select_related('author_profile')\
-            .filter(pk__in=self.revision_set.values_list('author', flat=True))\
-            .order_by('revision__pk')
-
-    def award_points_to_author(self):
-        self.original_author.scoretransaction_set.create(change=settings.ACTIVITY_POINTS['receiving_kudos_as_author'],
-                                                         operation='Received kudos for article {}'.format(self.pk))
-
-    def award_points_to_editors(self):
-        editors = self.revision_set.exclude(author=self.original_author).values_list('author', flat=True)
-        score_change = settings.ACTIVITY_POINTS['receiving_kudos_as_editor']
-        # We want to create this in a bulk operation, so the ScoreTransaction.save() method wouldn't get called
-        # This means that we need to manually update the editors' scores.
-        Author.objects.filter(user__in=editors).update(score=F('score') + score_change)
-        editor_scores = [ScoreTransaction(user_id=editor,
-                                          change=settings.ACTIVITY_POINTS['receiving_kudos_as_editor'],
-                                          operation='Received kudos for editing article {}'.format(self.pk))
-                         for editor in editors]
-        ScoreTransaction.objects.bulk_create(editor_scores)
+            .filter(articlecontributor__article=self)\
+            .order_by('articlecontributor__first_edit_at', 'articlecontributor__pk')
 
-    @atomic
+    def award_kudos_points(self):
+        """
+        Award the points for a kudos to the original author and to every other contributor.
+
+        All the transactions are created in one bulk operation, so ScoreTransaction.save() is not called, and the
+        scores are updated here with a single UPDATE.
+        """
+        points = settings.ACTIVITY_POINTS
+        transactions = [ScoreTransaction(user_id=self.original_author_id, change=points['receiving_kudos_as_author'],
+                                         operation='Received kudos for article {}'.format(self.pk))]
+        editors = self.articlecontributor_set.exclude(user=self.original_author_id).values_list('user', flat=True)
+        transactions.extend(ScoreTransaction(user_id=editor, change=points['receiving_kudos_as_editor'],
+                                             operation='Received kudos for editing article {}'.format(self.pk))
+                            for editor in editors)
+        ScoreTransaction.objects.bulk_create(transactions)
+        Author.objects.update_counter_in_bulk('score', dict((t.user_id, t.change) for t in transactions))
+
+    @batch_counters
     def receive_kudos(self, session_id='', user=None):
         try:
-            kudos = Kudos.objects.create(article=self, session_id=session_id, user=user)
+            with atomic():  # A savepoint, so that a duplicate kudos doesn't spoil the whole transaction
+                Kudos.objects.create(article=self, session_id=session_id, user=user)
         except IntegrityError:
-            pass
-        else:
-            self.kudos_received.add(kudos)
-            self.received_kudos_count += 1
-            self.save()
-            self.award_points_to_author()
-            self.award_points_to_editors()
-            if user is not None and user.is_authenticated():
-                user.author_profile.kudos_given_count += 1
-                user.author_profile.save()
+            return self.received_kudos_count
+        # Nothing in the article itself changes, so there's no need to go through save()
+        Article.all_objects.filter(pk=self.pk).update(received_kudos_count=F('received_kudos_count') + 1)
+        self.received_kudos_count += 1
+        if self.is_published:
+            Article.all_objects.update_hotness([self.pk])
+            Article.objects.mark_trending_tags_stale()
+        self.award_kudos_points()
+        if user is not None and user.is_authenticated():
+            user.author_profile.update_counters(kudos_given_count=1)
+        if self.counts_as_published:  # Kudos change the hot ordering and the counts of the cached pages
+            Article.objects.invalidate_page_cache()
         return self.received_kudos_count
 
     @atomic
@@ -275,14 +500,39 @@ class Article(Taggable, models.Model):
 
     def is_editors_pick(self):
         # FIXME: Probably this should be denormalized, somewhere down the road
+        if 'articlegroup_set' in getattr(self, '_prefetched_objects_cache', []):
+            return bool(self.articlegroup_set.all())
         return self.articlegroup_set.exists()
 
     @property
     def is_published(self):
         return self.published_at is not None
 
+    @property
+    def counts_as_published(self):
+        """
+        Whether the article is included in its original author's articles_published_count.
+        """
+        return self.is_published and self.deleted_at is None
+
+    @property
+    def counts_in_tag_cooccurrences(self):
+        # Going by what's stored, since tags can change before a change of publication state is saved (see save())
+        return self._was_counted_as_published
+
+    @classmethod
+    def counted_in_tag_cooccurrences(cls):
+        return cls.all_objects.filter(published_at__isnull=False, deleted_at__isnull=True)
+
     @staticmethod
     def count_links(text):
+        return len(Article.find_links(text))
+
+    @staticmethod
+    def find_links(text):
+        """
+        Return the set of the URLs in text.
+        """
         # full_re = r'(?i)\b((?:https?:(?:/{1,3}|[a-z0-9%])|[a-z0-9.\-]+[.](
         # ?:com|net|org|edu|gov|mil|aero|asia|biz|cat' \
         #           r'|coop|info|int|jobs|mobi|museum|name|post|pro|tel|travel|xxx|ac|ad|ae|af|ag|ai|al|am|an|ao|aq
@@ -320,7 +570,7 @@ class Article(Taggable, models.Model):
         # The above is taken from here: https://gist.github.com/gruber/8891611 and it might be useful if we need
         # to be more strict with URL checking; for the time being, I think that checking for http(s) should be enough.
         basic_re = r'(?:ht|f)tps?://\S+'
-        return len(set(re.findall(basic_re, text)))
+        return set(re.findall(basic_re, text))
 
     def count_own_links(self):
         return self.count_links(self.raw_content)
@@ -330,30 +580,18 @@ class Article(Taggable, models.Model):
         """
         Processes a markdown-formatted string, returning a dict that can be used to populate an Article instance
 
+        The results are cached by content hash, so the same content is never rendered twice in a row (e.g. when a form
+        is cleaned and the article is then saved).
+
         :param raw_content: markdown string
         :return: :rtype: dict
         """
-        data = {}
-        # Since we already have BeautifulSoup in the requirements, it makes sense to leverage it here.
-        data['full_rendered_content'] = markdown(raw_content)
-        soup = BeautifulSoup(data['full_rendered_content'])
-        try:
-            data['title'] = soup.find('h1').extract().encode_contents()
-        except AttributeError:  # Element not found
-            data['title'] = ''
-        # Markdown seems to add a paragraph and extra linebreaks inside blockquotes for some reason; in pre_v1 any HTML
-        # was skipped, but it was decided to  so we'll do the same here, and we'll remove the linebreaks too.
-        try:
-            data['punchline'] = soup.find('blockquote').extract().find('p').encode_contents().strip()
-        except AttributeError:
-            data['punchline'] = ''
-        try:
-            # Slightly more complex: we need to find the first H2, and extract the first P before it
-            data['description'] = soup.find('h2').find_previous('p').extract().encode_contents()
-        except AttributeError:
-            data['description'] = ''
-        data['rendered_html'] = soup.encode_contents()
-        return data
+        key = content_hash(raw_content)
+        data = rendered_content_cache.get(key)
+        if data is None:
+            data = render_article_content(raw_content)
+            rendered_content_cache.set(key, data)
+        return dict(data)  # A copy, since callers are free to alter it
 
 
 class Kudos(models.Model):
@@ -382,13 +620,13 @@ class ArticleGroupManager(models.Manager):
 
     def get_editors_picks(self, user=None):
         try:
-            return self.get_current_for_block('editors_picks').articles.get_queryset_for_user(user)
+            return self.get_current_for_block('editors_picks').articles.get_queryset_for_user(user).for_listing()
         except ArticleGroup.DoesNotExist:
             return Article.objects.none()
 
     def get_promoted_wip(self, user=None):
         try:
-            return self.get_current_for_block('wip').articles.get_queryset_for_user(user)
+            return self.get_current_for_block('wip').articles.get_queryset_for_user(user).for_listing()
         except ArticleGroup.DoesNotExist:
             return Article.objects.none()
 
@@ -415,12 +653,206 @@ class Revision(models.Model):
     title = models.CharField(max_length=255)
     description = models.TextField()
     punchline = models.CharField(max_length=255)
-    raw_content = models.TextField()
-    rendered_html = models.TextField(blank=True)
+    # Keyframes store the raw content as it is, the other revisions a patch against their keyframe (see raw_content)
+    stored_content = models.TextField(db_column='raw_content')
+    # Deleting a keyframe leaves its deltas alone, once they get their whole content back (see the pre_delete handler)
+    keyframe = models.ForeignKey('self', blank=True, null=True, default=None, related_name='deltas',
+                                 on_delete=models.DO_NOTHING)
+    # Change stats against the previous revision, worked out when the revision is created (see backfill_revision_stats
+    # for older ones)
+    lines_added = models.PositiveIntegerField(blank=True, null=True)
+    lines_removed = models.PositiveIntegerField(blank=True, null=True)
+    chars_added = models.PositiveIntegerField(blank=True, null=True)
+    chars_removed = models.PositiveIntegerField(blank=True, null=True)
+    links_added = models.PositiveIntegerField(blank=True, null=True)
+    # Digest of the fields above, so that duplicate revisions can be found without comparing the texts
+    content_hash = models.CharField(max_length=40, editable=False)
+
+    def __init__(self, *args, **kwargs):
+        self._raw_content = self._rendered_html = None
+        super(Revision, self).__init__(*args, **kwargs)
 
     def __unicode__(self):
         return self.title
 
+    @staticmethod
+    def compute_content_hash(data):
+        return content_hash(u'\0'.join(force_text(data[field] or u'') for field in REVISION_FIELDS))
+
+    @property
+    def raw_content(self):
+        return self.get_raw_content()
+
+    @raw_content.setter
+    def raw_content(self, value):
+        # Stored as a keyframe, until save() finds a keyframe to store it as a patch against
+        self.stored_content, self.keyframe = value, None
+        self._raw_content, self._rendered_html = value, None
+
+    def get_raw_content(self, keyframe_content=None):
+        """
+        Return the raw content of the revision, patching its keyframe if it's stored as a delta.
+
+        Any revision takes at most one more query and one patch to rebuild, since deltas are never made against deltas;
+        callers going through many revisions of an article can save the query passing the content of the keyframe.
+        """
+        if self._raw_content is None:
+            if self.keyframe_id is None:
+                self._raw_content = self.stored_content
+            else:
+                if keyframe_content is None:
+                    keyframe_content = Revision.objects.filter(pk=self.keyframe_id)\
+                        .values_list('stored_content', flat=True).get()
+                self._raw_content = apply_delta(keyframe_content, self.stored_content)
+        return self._raw_content
+
+    @property
+    def rendered_html(self):
+        if self._rendered_html is None:
+            self._rendered_html = Article.process_raw_content(self.raw_content)['rendered_html']
+        return self._rendered_html
+
+    def encode_content(self):
+        """
+        Store the raw content as a patch against the latest keyframe of the article, unless the keyframe already has
+        REVISION_KEYFRAME_INTERVAL - 1 deltas (and it's time for a new one) or the patch isn't worth it.
+        """
+        keyframe = Revision.objects.filter(article=self.article_id, keyframe__isnull=True)\
+            .values_list('pk', 'stored_content').first()
+        if keyframe is None or \
+                Revision.objects.filter(keyframe=keyframe[0]).count() >= settings.REVISION_KEYFRAME_INTERVAL - 1:
+            return
+        delta = make_delta(keyframe[1], self.get_raw_content())
+        if delta is not None:
+            self.stored_content, self.keyframe_id = delta, keyframe[0]
+
+    def get_previous(self):
+        """
+        Return the revision of the article before this one, loading just enough of it to get its raw content.
+        """
+        previous = Revision.objects.filter(article=self.article_id).only('stored_content', 'keyframe')
+        if self.pk:
+            previous = previous.filter(pk__lt=self.pk)
+        return previous.first()
+
+    def compute_change_stats(self, previous=None):
+        """
+        Work out how the revision changed the content of the previous one (or an empty one, for the first revision).
+        """
+        previous_content = previous.get_raw_content() if previous is not None else u''
+        content = self.get_raw_content()
+        for field, value in count_changes(previous_content, content).items():
+            setattr(self, field, value)
+        self.links_added = len(Article.find_links(content) - Article.find_links(previous_content))
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            self.compute_change_stats(self.get_previous())
+            if self.keyframe_id is None:
+                self.encode_content()
+        self.content_hash = Revision.compute_content_hash(dict((field, getattr(self, field))
+                                                               for field in REVISION_FIELDS))
+        super(Revision, self).save(*args, **kwargs)
+
     class Meta:
         get_latest_by = 'pk'
         ordering = ['-pk']
+        index_together = [['article', 'content_hash']]
+
+
+class ArticleContributorManager(models.Manager):
+    def record_edit(self, revision):
+        """
+        Account for a newly created revision in the contributors table of its article.
+
+        :return: True if the revision's author was not a contributor yet
+        """
+        updated = self.filter(article=revision.article_id, user=revision.author_id)\
+            .update(last_edit_at=revision.created_at, edits_count=F('edits_count') + 1)
+        if updated:
+            return False
+        try:
+            with atomic():
+                self.create(article_id=revision.article_id, user_id=revision.author_id,
+                            first_edit_at=revision.created_at, last_edit_at=revision.created_at, edits_count=1)
+        except IntegrityError:  # Somebody else recorded the first edit meanwhile
+            return self.record_edit(revision)
+        return True
+
+
+class ArticleContributor(models.Model):
+    """
+    One row per user who edited an article, kept up to date as revisions are created.
+    """
+    article = models.ForeignKey(Article)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL)
+    first_edit_at = models.DateTimeField()
+    last_edit_at = models.DateTimeField()
+    edits_count = models.PositiveIntegerField(default=0)
+
+    objects = ArticleContributorManager()
+
+    def __unicode__(self):
+        return u'{} on {}'.format(self.user, self.article)
+
+    class Meta:
+        unique_together = [['article', 'user']]
+
+
+def handler_published_count_on_delete(sender, instance, *args, **kwargs):
+    if instance.counts_as_published:
+        Author.objects.update_counters(instance.original_author_id, articles_published_count=-1)
+        Article.objects.invalidate_related_content()
+
+
+def handler_related_content_on_article_tags(sender, instance, action, reverse, *args, **kwargs):
+    # Only published articles are indexed, so drafts can be tagged without invalidating anything
+    if action.startswith('post_') and (reverse or instance.counts_as_published):
+        Article.objects.invalidate_related_content()
+
+
+def handler_related_content_on_tag(sender, instance, created=False, *args, **kwargs):
+    if not created:  # New tags aren't in any index yet
+        Article.objects.invalidate_related_content()
+
+
+def handler_deltas_on_keyframe_delete(sender, instance, **kwargs):
+    # Deltas being deleted along with their keyframe (like when their article is) get their content back all the same
+    if instance.keyframe_id is None:
+        for delta in instance.deltas.only('stored_content', 'keyframe'):
+            Revision.objects.filter(pk=delta.pk).update(
+                stored_content=delta.get_raw_content(instance.stored_content), keyframe=None)
+
+
+def handler_page_cache_invalidation(*args, **kwargs):
+    if kwargs.get('action', 'post_').startswith('post_'):
+        Article.objects.invalidate_page_cache()
+
+
+def handler_page_cache_on_article(sender, instance, action='post_', reverse=False, *args, **kwargs):
+    # Article saves take care of themselves; deleting or tagging drafts doesn't change any cached page
+    if action.startswith('post_') and (reverse or instance.counts_as_published):
+        Article.objects.invalidate_page_cache()
+
+
+def handler_page_cache_on_tag(sender, instance, created=False, *args, **kwargs):
+    if not created:  # New tags aren't on any page yet
+        Article.objects.invalidate_page_cache()
+
+
+pre_delete.connect(handler_deltas_on_keyframe_delete, Revision, weak=False, dispatch_uid='deltas_on_keyframe_delete')
+post_delete.connect(handler_published_count_on_delete, Article, weak=False, dispatch_uid='published_count_on_delete')
+m2m_changed.connect(handler_related_content_on_article_tags, Article.tags.through, weak=False,
+                    dispatch_uid='related_content_on_article_tags')
+post_save.connect(handler_related_content_on_tag, Tag, weak=False, dispatch_uid='related_content_on_tag_save')
+post_delete.connect(handler_related_content_on_tag, Tag, weak=False, dispatch_uid='related_content_on_tag_delete')
+post_delete.connect(handler_page_cache_on_article, Article, weak=False, dispatch_uid='page_cache_on_article_delete')
+post_save.connect(handler_page_cache_on_tag, Tag, weak=False, dispatch_uid='page_cache_on_tag_save')
+post_delete.connect(handler_page_cache_on_tag, Tag, weak=False, dispatch_uid='page_cache_on_tag_delete')
+post_save.connect(handler_page_cache_invalidation, ArticleGroup, weak=False, dispatch_uid='page_cache_on_group_save')
+post_delete.connect(handler_page_cache_invalidation, ArticleGroup, weak=False,
+                    dispatch_uid='page_cache_on_group_delete')
+m2m_changed.connect(handler_page_cache_on_article, Article.tags.through, weak=False,
+                    dispatch_uid='page_cache_on_article_tags')
+m2m_changed.connect(handler_page_cache_invalidation, ArticleGroup.articles.through, weak=False,
+                    dispatch_uid='page_cache_on_group_articles')
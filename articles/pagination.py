@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+import base64
+import binascii
+import collections
+import datetime
+import json
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.http import Http404
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(value, pk):
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([value, pk]))
+
+
+def decode_cursor(cursor, field):
+    try:
+        value, pk = json.loads(base64.urlsafe_b64decode(str(cursor)))
+        return field.to_python(value), int(pk)
+    except (TypeError, ValueError, binascii.Error, ValidationError):
+        raise InvalidCursor(cursor)
+
+
+class KeysetPage(collections.Sequence):
+    """
+    A page of objects, with the opaque cursor to get the next one - if there is one.
+    """
+    def __init__(self, object_list, next_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def paginate_by_keyset(queryset, cursor, page_size):
+    """
+    Return the KeysetPage of queryset following the one that cursor comes from (or the first one, without a cursor).
+
+    The queryset has to be ordered by a single field of its model, which is paired with the pk to make the order
+    total; pages are then found by comparing (field, pk) with the last values of the previous page, which an index on
+    (field, id) can answer without scanning the pages before it. Like PostgreSQL, NULLs come first when descending.
+
+    :raise InvalidCursor: when the cursor can't be decoded
+    """
+    ordering = queryset.query.order_by or queryset.model._meta.ordering
+    if len(ordering) != 1:
+        raise ValueError('Keyset pagination needs the queryset to be ordered by exactly one field')
+    descending = ordering[0].startswith('-')
+    pk_name = queryset.model._meta.pk.name
+    name = ordering[0].lstrip('-')
+    field = queryset.model._meta.get_field(pk_name if name == 'pk' else name)
+    if field.primary_key:
+        ordering = [ordering[0]]
+    else:
+        ordering = [ordering[0], '-' + pk_name if descending else pk_name]
+    queryset = queryset.order_by(*ordering)
+
+    if cursor:
+        value, pk = decode_cursor(cursor, field)
+        if field.primary_key:
+            queryset = queryset.filter(**{pk_name + ('__lt' if descending else '__gt'): pk})
+        else:
+            qn = connection.ops.quote_name
+            table = qn(queryset.model._meta.db_table)
+            column, pk_column = [u'{}.{}'.format(table, qn(f.column)) for f in (field, queryset.model._meta.pk)]
+            operator = '<' if descending else '>'
+            # Row comparisons can be answered by the (field, id) index, where the equivalent ORs can't
+            if value is None:
+                where = u'({column} IS NULL AND {pk} {op} %s)'
+                where += u' OR {column} IS NOT NULL' if descending else u''
+                params = [pk]
+            else:
+                where = u'({column}, {pk}) {op} (%s, %s)'
+                where += u'' if descending else u' OR {column} IS NULL'
+                params = [value, pk]
+            queryset = queryset.extra(where=[where.format(column=column, pk=pk_column, op=operator)], params=params)
+
+    object_list = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(object_list) > page_size:
+        object_list = object_list[:page_size]
+        last = object_list[-1]
+        next_cursor = encode_cursor(field.value_from_object(last), last.pk)
+    return KeysetPage(object_list, next_cursor)
+
+
+class KeysetPaginationMixin(object):
+    """
+    Paginate a ListView by keyset, reading the cursor from the cursor_param GET parameter.
+    """
+    cursor_param = 'cursor'
+
+    def paginate_queryset(self, queryset, page_size):
+        cursor = self.request.GET.get(self.cursor_param)
+        try:
+            page = paginate_by_keyset(queryset, cursor, page_size)
+        except InvalidCursor:
+            raise Http404
+        return None, page, page.object_list, bool(cursor) or page.has_next()
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+import hashlib
+import threading
+from django.conf import settings
+from markdown import Markdown
+from markdown.extensions import Extension
+from markdown.treeprocessors import Treeprocessor
+
+
+def content_hash(text):
+    """
+    Return a stable digest of a (possibly unicode) string, suitable as a cache key.
+    """
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return hashlib.sha1(text).hexdigest()
+
+
+class LRUCache(object):
+    """
+    A small thread-safe mapping that evicts the least recently used entry when it grows past max_size.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.entries.pop(key)
+            except KeyError:
+                return default
+            self.entries[key] = value  # Moving it to the most recently used end
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+
+# Rendered markdown, keyed by the content_hash of the raw content
+rendered_content_cache = LRUCache(settings.MARKDOWN_RENDER_CACHE_SIZE)
+
+
+class ArticleTreeprocessor(Treeprocessor):
+    """
+    Keeps a reference to the final element tree, so the article metadata can be pulled out of it after rendering.
+    """
+    def run(self, root):
+        self.markdown.article_tree = root
+
+
+class ArticleExtension(Extension):
+    def extendMarkdown(self, md, md_globals):
+        md.article_tree = None
+        md.treeprocessors.add('article', ArticleTreeprocessor(md), '_end')
+
+
+def _postprocess(md, html):
+    for postprocessor in md.postprocessors.values():
+        html = postprocessor.run(html)
+    return html
+
+
+def _inner_html(md, element):
+    tail, element.tail = element.tail, None
+    html = md.serializer(element)
+    element.tail = tail
+    return _postprocess(md, html[html.index('>') + 1:html.rindex('</')])
+
+
+def _extract(parents, element):
+    """
+    Remove an element from the tree, leaving the text that follows it in place.
+    """
+    parent = parents[element]
+    index = list(parent).index(element)
+    if element.tail:
+        if index:
+            parent[index - 1].tail = (parent[index - 1].tail or '') + element.tail
+        else:
+            parent.text = (parent.text or '') + element.tail
+    parent.remove(element)
+
+
+def _find(root, tag):
+    return next(root.iter(tag), None)
+
+
+def render_article_content(raw_content):
+    """
+    Render a markdown-formatted article, splitting out its title, punchline and description.
+
+    The title is the first h1, the punchline is the content of the paragraph in the first blockquote and the
+    description is the last paragraph before the first h2; they are removed from rendered_html, while
+    full_rendered_content keeps the whole document. Everything is taken from the element tree built while rendering,
+    so the markdown is only parsed once.
+
+    The markup is the same the BeautifulSoup extraction used to produce, but it is serialized as markdown does it:
+    values are unicode rather than utf-8 encoded strings, void elements are closed as in full_rendered_content
+    (<br />, <hr />, <img ... />) and character entities are kept as written rather than decoded. The rerender_articles
+    command brings the values stored before then in line.
+
+    :param raw_content: markdown string
+    :return: :rtype: dict
+    """
+    md = Markdown(extensions=[ArticleExtension()])
+    data = dict.fromkeys(['title', 'punchline', 'description', 'rendered_html'], u'')
+    data['full_rendered_content'] = md.convert(raw_content)
+    root = md.article_tree
+    if root is None:  # Blank document, markdown skips the processing altogether
+        return data
+    # The rendered document has been stripped of its surrounding whitespace, and we need to mirror that
+    if root.text and not root.text.strip():
+        root.text = None
+    if len(root) and root[-1].tail and not root[-1].tail.strip():
+        root[-1].tail = None
+    parents = dict((child, parent) for parent in root.iter() for child in parent)
+
+    title = _find(root, 'h1')
+    if title is not None:
+        data['title'] = _inner_html(md, title)
+        _extract(parents, title)
+    # Markdown seems to add a paragraph and extra linebreaks inside blockquotes for some reason; in pre_v1 any HTML
+    # was skipped, so we'll keep the paragraph content only, and we'll remove the linebreaks too.
+    punchline = _find(root, 'blockquote')
+    if punchline is not None:
+        _extract(parents, punchline)
+        paragraph = _find(punchline, 'p')
+        if paragraph is not None:
+            data['punchline'] = _inner_html(md, paragraph).strip()
+    # Slightly more complex: we need to find the first h2, and extract the last p before it
+    description = None
+    for element in root.iter():
+        if element.tag == 'h2':
+            break
+        if element.tag == 'p':
+            description = element
+    else:
+        description = None
+    if description is not None:
+        data['description'] = _inner_html(md, description)
+        _extract(parents, description)
+
+    html = md.serializer(root)
+    try:
+        html = html[html.index('<%s>' % md.doc_tag) + len(md.doc_tag) + 2:html.rindex('</%s>' % md.doc_tag)]
+    except ValueError:  # Nothing left
+        html = ''
+    data['rendered_html'] = _postprocess(md, html)
+    return data
@@ -21,6 +21,13 @@ def drilldown_link(context, new_tag):
     return query.urlencode()
 
 
+@register.simple_tag(takes_context=True)
+def cursor_link(context, cursor, param='cursor'):
+    query = context['request'].GET.copy()
+    query[param] = cursor
+    return query.urlencode()
+
+
 @register.simple_tag(takes_context=True)
 def active(context, param, current, default=False, emit='active'):
     value = context['request'].GET.get(param)
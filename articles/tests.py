@@ -2,22 +2,36 @@ from django.conf import settings
 from django.contrib.admin import AdminSite
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.core.urlresolvers import reverse
+from django.db import connection, OperationalError
 from django.http import QueryDict, HttpRequest
 from django.template import RequestContext
 from django.test import TestCase, RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.utils.html import escape
 from django.utils.timezone import now
 from django.utils.unittest.case import skip
 from django_dynamic_fixture import G, F, N
 from datetime import timedelta
+from bs4 import BeautifulSoup
 from django_webtest import WebTest
 from markdown import markdown
+import mock
+from StringIO import StringIO
 from urlparse import urlparse
 from articles.admin import ArticleAdmin
 from articles.forms import ArticleForm
-from articles.models import Article, ArticleGroup, Revision
-from tags.models import Tag
+from articles.models import Article, ArticleGroup, Revision, ArticleView
+from articles.pagination import paginate_by_keyset
+from articles.rendering import LRUCache, rendered_content_cache, render_article_content
+from articles.tracking import ArticleViewBuffer, article_views
+from articles.views import ArticleListByTagView
+from profiles.models import Author
+from tags.models import Tag, TagCooccurrence
+from tags.postings import TagPostings
 
 
 class TestArticleSets(TestCase):
@@ -152,6 +166,7 @@ class TestArticleModels(TestCase):
         self.assertSequenceEqual(articles[3:], Article.objects.sorted_by_hot()[:2])
         # If we change the timestamp on [3] Kudos, we expect its hotness to decay, leaving [4] as first
         articles[3].kudos_received.all().update(timestamp=now()-timedelta(14))  # 2 weeks should be enough
+        Article.objects.update_hotness()  # Hotness is materialized, so the decay is only applied when recomputing
         self.assertEqual(articles[4], Article.objects.sorted_by_hot()[0])
         # If we restore the kudos and change the publish date for 3, we expect the same result
         articles[3].kudos_received.all().update(timestamp=now())
@@ -161,13 +176,26 @@ class TestArticleModels(TestCase):
 
     def test_old_articles_do_not_cause_underflow(self):
         articles = G(Article, n=5, published_at=now()-timedelta(10000))
-        list(Article.objects.sorted_by_hot())  # The query needs to be evaluated
+        self.assertEqual(Article.objects.update_hotness(), 5)
+        list(Article.objects.sorted_by_hot(from_date=now()-timedelta(31)))  # The query needs to be evaluated
+
+    def test_hotness_is_materialized_on_the_article(self):
+        article, other = G(Article, n=2, published_at=now(), deleted_at=None)
+        self.assertEqual(Article.objects.get(pk=article.pk).hotness, 0)
+        article.receive_kudos(session_id='1')
+        self.assertGreater(Article.objects.get(pk=article.pk).hotness, 0)
+        # Recomputing for a subset of articles should leave the others untouched
+        Article.objects.filter(pk=other.pk).update(hotness=10)
+        self.assertEqual(Article.objects.update_hotness([article.pk]), 1)
+        self.assertEqual(Article.objects.get(pk=other.pk).hotness, 10)
+        self.assertEqual(Article.objects.update_hotness([]), 0)
 
     def test_hotness_sorting_differentiates_between_0_and_1_kudos(self):
         articles = G(Article, n=3, deleted_at=None)
         articles[1].receive_kudos()
         self.assertEqual(articles[1], Article.objects.sorted_by_hot()[0])
 
+    @override_settings(TRENDING_TAGS_WARMING_ENABLED=True)
     def test_trending_tags_can_be_retrieved(self):
         articles = self.generate_hot_articles()
         articles[0].set_tag('non-hot')
@@ -177,8 +205,32 @@ class TestArticleModels(TestCase):
         articles[4].set_tag('hot2')
         # To avoid using the Tag object directly we'll check for values
         # Please note that, since the list is sorted on an annotated field, the field must be included
-        self.assertSequenceEqual([('hot2', 2), ('hot1', 1), ],
-                                 Article.objects.get_trending_tags().values_list('title', 'uses_count'))
+        # Tagging does not refresh the cache, the warm_trending_tags command does
+        call_command('warm_trending_tags', stdout=StringIO())
+        with self.assertNumQueries(0):
+            trending_tags = Article.objects.get_trending_tags()
+        self.assertSequenceEqual([('hot2', 2), ('hot1', 1), ], [(t.title, t.uses_count) for t in trending_tags])
+
+    @override_settings(TRENDING_TAGS_WARMING_ENABLED=True)
+    def test_trending_tags_are_refreshed_after_kudos(self):
+        articles = G(Article, n=2, published_at=now(), deleted_at=None)
+        articles[0].set_tag('hot')
+        articles[1].set_tag('not-yet-hot')
+        articles[0].receive_kudos(session_id='1')
+        call_command('warm_trending_tags', if_stale=True, stdout=StringIO())
+        self.assertSequenceEqual(['hot'], [t.title for t in Article.objects.get_trending_tags()])
+        # Kudos only mark the trending tags as stale, leaving the work to the command
+        articles[1].receive_kudos(session_id='1')
+        with self.assertNumQueries(0):
+            self.assertSequenceEqual(['hot'], [t.title for t in Article.objects.get_trending_tags()])
+        call_command('warm_trending_tags', if_stale=True, stdout=StringIO())
+        self.assertItemsEqual(['hot', 'not-yet-hot'], [t.title for t in Article.objects.get_trending_tags()])
+        out = StringIO()
+        call_command('warm_trending_tags', if_stale=True, stdout=out)
+        self.assertIn('up to date', out.getvalue())
+        # The command has nothing to warm without a cache shared with the web processes
+        with self.settings(TRENDING_TAGS_WARMING_ENABLED=False), self.assertRaises(CommandError):
+            call_command('warm_trending_tags', stdout=StringIO())
 
     def test_articles_is_editable_by_user_method(self):
         author, visitor = G(get_user_model(), n=2)
@@ -247,6 +299,26 @@ class TestArticleModels(TestCase):
         self.assertEqual(article.description, '')
         self.assertEqual(article.punchline, 'The <strong>punchline</strong>')
 
+    def test_rendering_is_cached_by_content(self):
+        raw_content = '# A cached title\n\n> The punchline\n\nThe intro\n\n## The body'
+        rendered_content_cache.clear()
+        with mock.patch('articles.models.render_article_content', wraps=render_article_content) as mocked_render:
+            data = Article.process_raw_content(raw_content)
+            data['title'] = 'Changed by the caller'  # This should not leak into the cache
+            data = Article.process_raw_content(raw_content)
+        self.assertEqual(mocked_render.call_count, 1)
+        self.assertEqual(data['title'], 'A cached title')
+
+    def test_render_cache_evicts_least_recently_used_entries(self):
+        render_cache = LRUCache(2)
+        render_cache.set('first', 1)
+        render_cache.set('second', 2)
+        render_cache.get('first')
+        render_cache.set('third', 3)
+        self.assertEqual(len(render_cache), 2)
+        self.assertIn('first', render_cache)
+        self.assertNotIn('second', render_cache)
+
     def test_deleted_articles_are_only_visible_in_admin(self):
         a = G(Article, deleted_at=now())  # Explicitly setting it as deleted
         self.assertFalse(Article.objects.filter(pk=a.pk).exists())
@@ -271,7 +343,20 @@ class TestArticleModels(TestCase):
             a.raw_content += '\n\nWith extra line {}'.format(u)  # So we save a new version everytime
             a.author = authors[u]
             a.save()
-        self.assertSequenceEqual(a.all_contributors, [authors[n] for n in [3, 1, 4, 1, 5]])
+        self.assertSequenceEqual(a.all_contributors, [authors[n] for n in [3, 1, 4, 5]])
+        self.assertSequenceEqual(a.other_contributors, [authors[n] for n in [1, 4, 5]])
+
+    def test_contributors_are_tracked_incrementally(self):
+        authors = G(get_user_model(), n=2)
+        a = G(Article, deleted_at=None, author=authors[0], raw_content='# The Title\n\nFirst')
+        for n, u in enumerate([1, 1, 0]):
+            a.raw_content += '\n\nEdit {}'.format(n)
+            a.author = authors[u]
+            a.save()
+        contributors = a.articlecontributor_set.order_by('first_edit_at')
+        self.assertSequenceEqual([(c.user, c.edits_count) for c in contributors], [(authors[0], 2), (authors[1], 2)])
+        self.assertEqual(contributors[1].last_edit_at, a.revision_set.filter(author=authors[1]).latest().created_at)
+        self.assertEqual(a.editors_count, 2)
 
 
 class TestArticleKudos(WebTest):
@@ -312,8 +397,36 @@ class TestArticleKudos(WebTest):
         self.app.post(url, user=u.username, headers={'Cookie': 'sessionid=fakesessionid_2;'})
         self.assertEqual(a.kudos_received.count(), 1)
 
+    def test_kudos_award_points_to_all_contributors_in_bulk(self):
+        author, editor1, editor2 = G(get_user_model(), n=3)
+        a = G(Article, deleted_at=None, published_at=None, author=author, raw_content='# Title\n\nFirst')
+        for n, editor in enumerate([editor1, editor2, editor1]):
+            a.author = editor
+            a.raw_content += '\n\nEdit {}'.format(n)
+            a.save()
+        scores = dict(Author.objects.values_list('user', 'score'))
+        a = Article.objects.get(pk=a.pk)
+        # Two pairs of savepoint queries, plus kudos, counter, contributors, transactions and scores
+        with self.assertNumQueries(9):
+            self.assertEqual(a.receive_kudos(session_id='1'), 1)
+        self.assertEqual(Article.objects.get(pk=a.pk).received_kudos_count, 1)
+        points = settings.ACTIVITY_POINTS
+        for user, change in [(author, points['receiving_kudos_as_author']),
+                             (editor1, points['receiving_kudos_as_editor']),
+                             (editor2, points['receiving_kudos_as_editor'])]:
+            self.assertEqual(Author.objects.get(user=user).score, scores[user.pk] + change)
+            self.assertEqual(user.scoretransaction_set.filter(operation__startswith='Received kudos').count(), 1)
+
 
 class TestArticleViews(WebTest):
+    def setUp(self):
+        super(TestArticleViews, self).setUp()
+        cache.clear()  # Pages and generations cached by earlier tests would outlive their fixtures
+
+    def tearDown(self):
+        cache.clear()
+        super(TestArticleViews, self).tearDown()
+
     def test_only_author_can_view_unpublished_articles(self):
         u, u2 = G(get_user_model(), n=2)
         #admin = G(get_user_model(), username='admin', is_superuser=True)
@@ -358,6 +471,7 @@ class TestArticleViews(WebTest):
         self.assertFalse(a.articleview_set.count())
         url = reverse('articles_article_detail', args=(a.pk,))
         self.app.get(url)
+        article_views.flush()  # Views are buffered, so we need to write them out before checking
         # Having seen the page, we expect the following to happen:
         # 1. The article's views_count is incremented
         # 2. An ArticleView object is created for auditing purposes
@@ -368,6 +482,7 @@ class TestArticleViews(WebTest):
         # We need to remove everything because otherwise the empty session_id causes a caught IntegrityError
         a.articleview_set.all().delete()
         self.app.get(url, user=u.username)
+        article_views.flush()
         self.assertTrue(a.articleview_set.filter(user=u).exists())
 
     def test_views_can_be_incremented_restlike(self):
@@ -393,6 +508,7 @@ class TestArticleViews(WebTest):
         # Viewing the page as anon will require checking on sessionid
         self.app.get(url, headers={'Cookie': 'sessionid=fakesessionid;'})
         self.app.get(url, headers={'Cookie': 'sessionid=fakesessionid;'})
+        article_views.flush()
         self.assertEqual(a.articleview_set.count(), 2)
         self.assertEqual(Article.objects.get(pk=a.pk).views_count, 2)
         # Viewing the page with different session_id but the same user should result in no increase
@@ -400,8 +516,45 @@ class TestArticleViews(WebTest):
         a.articleview_set.all().delete()
         self.app.get(url, headers={'Cookie': 'sessionid=fakesessionid_1;'}, user=u.username)
         self.app.get(url, headers={'Cookie': 'sessionid=fakesessionid_2;'}, user=u.username)
+        article_views.flush()
         self.assertEqual(a.articleview_set.count(), 2)
 
+    def test_article_views_are_buffered_and_written_in_batches(self):
+        a1, a2, a3 = G(Article, n=3, deleted_at=None)
+        buffer = ArticleViewBuffer(max_size=10, flush_interval=3600)
+        for article in [a1, a1, a1, a2, a3]:
+            buffer.record(article, session_id='fakesessionid')
+        self.assertFalse(ArticleView.objects.exists())
+        # One INSERT and one UPDATE per distinct increment (a2 and a3 share theirs), wrapped in a savepoint
+        with self.assertNumQueries(5):
+            self.assertEqual(buffer.flush(), 5)
+        self.assertEqual(a1.articleview_set.count(), 3)
+        self.assertSequenceEqual([3, 1, 1], [Article.objects.get(pk=a.pk).views_count for a in [a1, a2, a3]])
+        # Reaching the maximum size triggers the flush automatically
+        for i in range(10):
+            buffer.record(a2)
+        self.assertEqual(Article.objects.get(pk=a2.pk).views_count, 11)
+        self.assertFalse(buffer.pending)
+
+    def test_article_views_that_cannot_be_written_do_not_block_the_others(self):
+        a1, a2 = G(Article, n=2, deleted_at=None)
+        buffer = ArticleViewBuffer(max_size=3, flush_interval=3600, max_pending=4)
+        # A session id that doesn't fit its column spoils the batch, but only its own view is dropped
+        with mock.patch('articles.tracking.logger'):
+            for article, session_id in [(a1, 'x' * 40), (a1, 'fakesessionid'), (a2, 'fakesessionid')]:
+                buffer.record(article, session_id=session_id)
+        self.assertFalse(buffer.pending)
+        self.assertSequenceEqual([1, 1], [Article.objects.get(pk=a.pk).views_count for a in [a1, a2]])
+        # When the database can't be reached, the views are kept for later, up to max_pending
+        with mock.patch.object(buffer, 'write', side_effect=OperationalError), \
+                mock.patch('articles.tracking.logger') as logger:
+            for i in range(6):
+                buffer.record(a2)
+        self.assertTrue(logger.exception.called)
+        self.assertEqual(len(buffer.pending), 4)
+        self.assertEqual(buffer.flush(), 4)
+        self.assertEqual(Article.objects.get(pk=a2.pk).views_count, 5)
+
     def test_articles_can_be_created(self):
         t = G(Tag)
         u = G(get_user_model())
@@ -465,6 +618,33 @@ class TestArticleViews(WebTest):
         article.save()
         self.assertEqual(len(article.revision_set.all()), 2)
 
+    def test_revisions_are_stored_as_deltas_against_keyframes(self):
+        lines = ['- [Link {0}](http://example.com/{0})'.format(i) for i in range(50)]
+        article = G(Article, raw_content='# A list\n\n' + '\n'.join(lines))
+        contents = [article.raw_content]
+        with self.settings(REVISION_KEYFRAME_INTERVAL=3):
+            for i in range(4):
+                lines[i * 10] = '- [Edited link {0}](http://example.org/{0})'.format(i)
+                article.raw_content = '# A list\n\n' + '\n'.join(lines)
+                article.save()
+                contents.append(article.raw_content)
+        revisions = list(article.revision_set.order_by('pk'))
+        # A new keyframe every three revisions, with the others patched against the last one
+        self.assertEqual([r.keyframe_id for r in revisions],
+                         [None, revisions[0].pk, revisions[0].pk, None, revisions[3].pk])
+        self.assertLess(len(revisions[1].stored_content), len(contents[1]) / 4)
+        # Any revision can be rebuilt from a fresh instance, and its HTML rendered again
+        for revision, content in zip(revisions, contents):
+            revision = Revision.objects.get(pk=revision.pk)
+            self.assertEqual(revision.get_raw_content(), content)
+            self.assertEqual(revision.rendered_html, Article.process_raw_content(content)['rendered_html'])
+        # Deleting a keyframe leaves its deltas in full, rather than deleting them along with it
+        revisions[0].delete()
+        self.assertEqual([(r.keyframe_id, r.get_raw_content()) for r in article.revision_set.order_by('pk')],
+                         [(None, contents[1]), (None, contents[2]), (None, contents[3]), (revisions[3].pk, contents[4])])
+        article.delete()
+        self.assertFalse(Revision.objects.filter(article=article.pk).exists())
+
     def test_article_creation_and_editing_views_require_login(self):
         url = reverse('articles_article_create')
         response = self.app.get(url)
@@ -489,18 +669,78 @@ class TestArticleViews(WebTest):
         self.assertEqual(version.rendered_html, rev.rendered_html)
         self.assertEqual(version.raw_content, rev.raw_content)
 
+    def test_article_pages_support_conditional_get(self):
+        article = G(Article, deleted_at=None, published_at=now())
+        url = reverse('articles_article_detail', args=(article.pk, ))
+        article_views.flush()
+        etag = self.app.get(url).headers['ETag']
+        self.app.get(url, headers={'If-None-Match': etag}, status=304)
+        article_views.flush()
+        self.assertEqual(article.articleview_set.count(), 2)  # The view is counted anyway
+        # The page changes with kudos and with the user looking at it
+        article.receive_kudos(session_id='somesession')
+        response = self.app.get(url, headers={'If-None-Match': etag}, status=200)
+        self.app.get(url, headers={'If-None-Match': response.headers['ETag']}, status=304)
+        user = G(get_user_model())
+        self.app.get(url, headers={'If-None-Match': response.headers['ETag']}, user=user.username, status=200)
+        # The source has a Last-Modified too, which changes with the article
+        source_url = reverse('articles_article_source', args=(article.pk, ))
+        response = self.app.get(source_url)
+        self.app.get(source_url, headers={'If-Modified-Since': response.headers['Last-Modified']}, status=304)
+        article.raw_content += '\n\nMore content.'
+        article.save()
+        self.app.get(source_url, headers={'If-None-Match': response.headers['ETag']}, status=200)
+
     def test_articles_can_be_listed_by_tag(self):
         tag = G(Tag, title='some-tag')
         articles = G(Article, n=2, tags=[tag], deleted_at=None)
         url = reverse('articles_list_by_tag', args=(tag.title, ))
         response = self.app.get(url)
         self.assertIn('article_list', response.context)
-        self.assertSequenceEqual(articles, response.context['article_list'])
+        self.assertSequenceEqual(articles[::-1], response.context['article_list'])  # Ties go to the newest article
         # the relevant part is that, if we add another article with a different tag, we don't expect it to show up
         unwanted_article = G(Article, tags=[F(title='a-different-tag')])
+        cache.clear()  # Unlisted articles don't drop the cached page, and the context is only there for fresh ones
         response = self.app.get(url)
         self.assertNotIn(unwanted_article, response.context['article_list'])
 
+    def test_article_lists_leave_out_heavy_columns(self):
+        article = G(Article, deleted_at=None, published_at=now(), tags=[F(title='some-tag')])
+        G(ArticleGroup, articles=[article], publish_start=now(), target_block='editors_picks')
+        urls = [reverse('homepage'), reverse('articles_list_by_tag', args=('some-tag', )),
+                reverse('profiles_profile', args=(article.author.username, )),
+                reverse('articles_feed_by_tag', args=('some-tag', )), reverse('sitemap')]
+        for url in urls:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.app.get(url)
+            self.assertIn(article.get_absolute_url(), response)
+            heavy_queries = [query['sql'] for query in queries if '"articles_article"."raw_content"' in query['sql']]
+            self.assertEqual(heavy_queries, [], url)
+
+    def test_article_lists_are_paginated_by_keyset(self):
+        tag = G(Tag, title='some-tag')
+        articles = G(Article, n=7, tags=[tag], deleted_at=None, published_at=now())
+        for n, article in enumerate(articles):  # With ties and NULLs to get past
+            Article.objects.filter(pk=article.pk).update(views_count=n % 3, updated_at=None if n % 2 else now())
+        for ordering in ['-hotness', '-views_count', '-updated_at', 'updated_at', '-pk']:
+            qs = Article.objects.order_by(ordering)
+            expected = list(qs.order_by(ordering, '-pk' if ordering.startswith('-') else 'pk'))
+            pages = [paginate_by_keyset(qs, None, 2)]
+            while pages[-1].has_next():
+                pages.append(paginate_by_keyset(qs, pages[-1].next_cursor, 2))
+            self.assertEqual([len(page) for page in pages], [2, 2, 2, 1])
+            self.assertSequenceEqual([article for page in pages for article in page], expected)
+        # The views carry the cursor in the query string
+        url = reverse('articles_list_by_tag', args=(tag.title, ))
+        with self.settings(ARTICLE_LIST_PAGE_SIZE=4):
+            response = self.app.get(url + '?sort=views')
+            self.assertEqual(len(response.context['article_list']), 4)
+            response = response.click('load more')
+            self.assertEqual(response.request.GET['sort'], 'views')
+            self.assertEqual(len(response.context['article_list']), 3)
+            self.assertFalse(response.context['page_obj'].has_next())
+        self.app.get(url + '?cursor=garbage', status=404)
+
     @skip('work in progress articles no longer have dedicated list in tag pages')
     def test_wip_articles_in_tag_pages_have_editorspick_class_when_appropriate(self):
         tag = G(Tag, title='some-tag')
@@ -549,6 +789,8 @@ class TestArticleViews(WebTest):
         self.assertEqual(len(response.context['related_articles_one']), 0)  # and articles here are drafts
         # Update all the articles so that they're visibile
         Article.all_objects.update(published_at=now(), deleted_at=None)
+        Article.objects.invalidate_page_cache()  # Bulk updates don't send signals
+        call_command('rebuild_tag_cooccurrences', stdout=StringIO())
         response = self.app.get(url)
         self.assertEqual(t3, response.context['related_tag_one'])  # Based on number of articles
         self.assertEqual(t2, response.context['related_tag_two'])
@@ -577,6 +819,64 @@ class TestArticleViews(WebTest):
         self.assertItemsEqual(response.context['related_articles_one'], articles_t3+[common_article])
         self.assertItemsEqual(response.context['related_articles_two'], articles_t2)
 
+    def test_tag_cooccurrences_only_count_published_articles(self):
+        t1, t2 = G(Tag, title='first-tag'), G(Tag, title='second-tag')
+        draft = G(Article, deleted_at=None, published_at=None)
+        draft.tags.add(t1, t2)
+        self.assertFalse(TagCooccurrence.objects.exists())
+        draft.published_at = now()
+        draft.save()
+        self.assertEqual(t1.related(), [t2])
+        # Tagging an article which is being withdrawn is accounted for by the withdrawal
+        draft.tags.remove(t2)
+        draft.deleted_at = now()
+        draft.tags.add(t2)
+        draft.save()
+        self.assertFalse(TagCooccurrence.objects.exists())
+        published = G(Article, deleted_at=None, published_at=now())
+        published.tags.add(t1, t2)
+        self.assertEqual(t1.related(), [t2])
+        Article.all_objects.get(pk=published.pk).delete()
+        self.assertFalse(TagCooccurrence.objects.exists())
+        # The rebuild leaves out drafts and deleted articles too
+        call_command('rebuild_tag_cooccurrences', stdout=StringIO())
+        self.assertFalse(TagCooccurrence.objects.exists())
+
+    def test_related_content_is_indexed_until_tags_or_publication_change(self):
+        t1, t2 = G(Tag, title='first-tag', tag_type='technology'), G(Tag, title='second-tag', tag_type='field')
+        article, other = G(Article, n=2, tags=[t1], deleted_at=None, published_at=now())
+        related = G(Article, tags=[t1, t2], deleted_at=None, published_at=now())
+        compute = mock.patch.object(Article.objects.__class__, 'compute_related_content', autospec=True,
+                                    side_effect=Article.objects.__class__.compute_related_content)
+        with compute as compute_mock:
+            content = Article.objects.get_related_content(article)
+            self.assertItemsEqual(content['read_more'], [other, related])
+            self.assertEqual(content['related_tag_one'], t2)
+            # Until something changes, the index is reused
+            Article.objects.get_related_content(article)
+            self.assertEqual(compute_mock.call_count, 1)
+            # Withdrawing an article invalidates it
+            other.published_at = None
+            other.save()
+            self.assertSequenceEqual(Article.objects.get_related_content(article)['read_more'], [related])
+            self.assertEqual(compute_mock.call_count, 2)
+            # And so does tagging
+            newcomer = G(Article, deleted_at=None, published_at=now())
+            newcomer.tags.add(t1)
+            self.assertItemsEqual(Article.objects.get_related_content(article)['read_more'], [related, newcomer])
+            self.assertEqual(compute_mock.call_count, 3)
+            # But not the tagging of drafts, which aren't indexed
+            draft = G(Article, deleted_at=None, published_at=None)
+            draft.tags.add(t1)
+            Article.objects.get_related_content(article)
+            self.assertEqual(compute_mock.call_count, 3)
+        # The articles come with what their widgets show
+        content = Article.objects.get_related_content(article)
+        with self.assertNumQueries(0):
+            for related_article in content['read_more']:
+                related_article.original_author.author_profile.display_name
+                related_article.is_wip, related_article.is_editors_pick
+
     def test_articles_can_by_filtered_by_multiple_tags(self):
         t1, t2 = G(Tag, title='first-tag'), G(Tag, title='second-tag')
         articles = G(Article, n=2, deleted_at=None)
@@ -596,6 +896,98 @@ class TestArticleViews(WebTest):
         response = self.app.get(url+'?drilldown='+t2.title+'&drilldown='+t3.title)
         self.assertFalse(response.context['article_list'])
 
+    def test_drilldown_is_a_single_intersection_subquery(self):
+        tags = [G(Tag, title='tag-{}'.format(n)) for n in range(6)]
+        everything = G(Article, tags=tags, deleted_at=None, published_at=now())
+        G(Article, tags=tags[:5], deleted_at=None, published_at=now())
+        pks = Article.objects_as_tagged.tagged_with_all_pks([t.title for t in tags])
+        self.assertSequenceEqual(list(pks), [everything.pk])
+        sql = str(Article.objects.filter(pk__in=pks).query)
+        self.assertEqual(sql.count('articles_article_tags'), 1)
+        self.assertIn('HAVING', sql)
+        out = StringIO()
+        call_command('benchmark_drilldown', repeat=1, stdout=out)
+        self.assertEqual(len(out.getvalue().strip().splitlines()), 7)  # The header, and a line for each depth
+
+    def test_anonymous_visitors_are_served_cached_pages(self):
+        t1, t2 = G(Tag, title='first-tag'), G(Tag, title='second-tag')
+        article = G(Article, tags=[t1, t2], deleted_at=None, published_at=now())
+        url = reverse('articles_list_by_tag', args=(t1.title, ))
+        for path in ['/', url, url + '?drilldown=' + t2.title + '&drilldown=third-tag']:
+            first = self.app.get(path)
+            with self.assertNumQueries(0):
+                self.assertEqual(self.app.get(path).body, first.body)
+        # The order of the parameters doesn't matter, but their values do
+        with self.assertNumQueries(0):
+            self.app.get(url + '?drilldown=third-tag&drilldown=' + t2.title)
+        self.assertIsNotNone(self.app.get(url + '?sort=new').context)
+        # Changes to the articles are shown right away
+        article.receive_kudos(session_id='somesession')
+        self.assertIn(article, self.app.get(url).context['article_list'])
+        article.title = 'A new title'
+        article.save()
+        self.assertIn('A new title', self.app.get(url))
+        # Logged in users get fresh pages, and so do anonymous ones for pages with a CSRF token
+        user = G(get_user_model())
+        self.app.get(url, user=user.username)
+        self.assertIsNotNone(self.app.get(url, user=user.username).context)
+        detail_url = reverse('articles_article_detail', args=(article.pk, ))
+        article_views.flush()
+        self.app.get(detail_url)
+        self.assertIsNotNone(self.app.get(detail_url).context)
+        article_views.flush()
+        self.assertEqual(article.articleview_set.count(), 2)
+
+    def test_cached_pages_only_change_with_the_listed_articles(self):
+        author = G(get_user_model())
+        draft = G(Article, author=author, title='A draft', deleted_at=None, published_at=None)
+        G(ArticleGroup, articles=[draft], publish_start=now() - timedelta(1), target_block='editors_picks')
+        # The author gets their draft in the editors' picks, but it's never passed on to anonymous visitors
+        self.assertIn('A draft', self.app.get('/', user=author.username))
+        self.app.reset()
+        self.assertNotIn('A draft', self.app.get('/'))
+        generation = Article.objects.get_page_cache_generation()
+        draft.title = 'Still a draft'
+        draft.save()
+        draft.receive_kudos(session_id='somesession')  # Drafts' kudos aren't shown on any cached page either
+        self.assertEqual(Article.objects.get_page_cache_generation(), generation)
+        draft.published_at = now()
+        draft.save()
+        self.assertNotEqual(Article.objects.get_page_cache_generation(), generation)
+        self.assertIn('Still a draft', self.app.get('/'))
+
+    @override_settings(TAG_POSTINGS_ENABLED=True)
+    def test_tag_page_runs_a_constant_number_of_queries(self):
+        t1, t2, t3 = G(Tag, title='first-tag'), G(Tag, title='second-tag'), G(Tag, title='third-tag')
+        view = ArticleListByTagView.as_view()
+        # Unlisted, but it makes second-tag the tag most related to first-tag from the start
+        G(Article, tags=[t1, t2], deleted_at=None, published_at=None)
+        TagPostings.for_model(Article).rebuild()
+
+        def get_context_data(query=''):
+            request = RequestFactory().get(reverse('articles_list_by_tag', args=(t1.title, )) + query)
+            request.user = AnonymousUser()
+            return view(request, tag=t1.title).context_data
+
+        for n in range(1, 4):
+            G(Article, n=n, tags=[t1, t2], deleted_at=None, published_at=now())
+            G(Article, n=n, tags=[t2], deleted_at=None, published_at=now())
+            G(Article, n=n, tags=[t3], deleted_at=None, published_at=now())
+            G(Article, tags=[t1, t3], deleted_at=None, published_at=now()).is_wip = True
+            TagPostings.for_model(Article).flush()  # As it would be at the end of the request
+            # The articles with their tags and groups, the two queries for the related tags, and then the articles
+            # with their tags and groups for each related list
+            with self.assertNumQueries(11):
+                context_data = get_context_data()
+            self.assertEqual(len(context_data['article_list']), n * (n + 1) / 2)
+            self.assertEqual(len(context_data['wip_articles']), n)
+            self.assertEqual(context_data['related_tag_one'], t2)
+            # A drilldown needs the tag ids for the postings index, and takes the related tags from the articles
+            with self.assertNumQueries(7):
+                context_data = get_context_data('?drilldown=' + t2.title)
+            self.assertEqual(len(context_data['article_list']), n * (n + 1) / 2)
+            self.assertEqual(context_data['related_tag_one'], t2)
+
     def test_revision_list_shows_revisions_for_article(self):
         a = G(Article, deleted_at=None)
         url = reverse('articles_article_revision_list', args=(a.pk, ))
@@ -613,6 +1005,70 @@ class TestArticleViews(WebTest):
         response = self.app.get(url)
         self.assertNotIn(nonrevs, response.context['revision_list'])
 
+    def test_revision_list_is_paginated_and_summarized(self):
+        article = G(Article, raw_content='# Title\n\nFirst line', deleted_at=None)
+        article.raw_content = '# Title\n\nFirst line, edited\nSecond line\nThird line'
+        article.save()
+        for author in G(get_user_model(), n=3):
+            article.author, article.raw_content = author, article.raw_content + '\nBy ' + author.username
+            article.save()
+        url = reverse('articles_article_revision_list', args=(article.pk, ))
+        revisions = list(article.revision_set.all())
+        self.assertEqual([(r.lines_added, r.lines_removed) for r in revisions[-2:]], [(3, 1), (3, 0)])
+        Article.objects.get_trending_tags()  # Cached across requests
+        with self.settings(REVISION_LIST_PAGE_SIZE=2):
+            # The article with its tags and groups, and the revisions with their authors and profiles
+            with self.assertNumQueries(4):
+                response = self.app.get(url)
+            self.assertEqual([r.pk for r in response.context['revision_list']], [r.pk for r in revisions[:2]])
+            self.assertIn('+2 -1 lines', ' '.join(response.html.select('.revision-changes')[0].text.split()))
+            response = response.click('load more')
+            self.assertEqual([r.pk for r in response.context['revision_list']], [r.pk for r in revisions[2:4]])
+            # Past the first page, every revision can be diffed against the current version
+            self.assertEqual(len(response.html.select('a.diff-link')), 2)
+            response = response.click('load more')
+            self.assertEqual([r.pk for r in response.context['revision_list']], [r.pk for r in revisions[4:]])
+            self.assertFalse(response.html.find('a', text='load more'))
+
+    def test_revision_change_stats_are_stored_and_backfilled(self):
+        article = G(Article, raw_content='# Title\n\nSee http://a.com', deleted_at=None)
+        article.raw_content = '# Title\n\nSee http://b.com and http://c.com\nMore'
+        article.save()
+        fields = ['lines_added', 'lines_removed', 'chars_added', 'chars_removed', 'links_added']
+        stats = list(article.revision_set.order_by('pk').values_list(*fields))
+        self.assertEqual(stats, [(3, 0, 25, 0, 1), (2, 1, 27, 5, 2)])
+        Revision.objects.filter(article=article).update(**dict.fromkeys(fields, None))
+        out = StringIO()
+        call_command('backfill_revision_stats', processes=1, stdout=out)
+        self.assertEqual(list(article.revision_set.order_by('pk').values_list(*fields)), stats)
+        self.assertIn('Updated the change stats of 2 revisions of 1 articles', out.getvalue())
+        # The articles are handed out in batches, each taken in once
+        G(Article, n=2, deleted_at=None)
+        out = StringIO()
+        call_command('backfill_revision_stats', processes=1, batch_size=2, recompute=True, stdout=out)
+        self.assertEqual(out.getvalue().splitlines(), ['2 of 3 articles done, 3 revisions updated',
+                                                       '3 of 3 articles done, 4 revisions updated',
+                                                       'Updated the change stats of 4 revisions of 3 articles'])
+
+    def test_stored_articles_can_be_rendered_again(self):
+        article = G(Article, raw_content='# AT&T\n\n> A  \nbreak\n\nIntro\n\n## Section\n\n---', deleted_at=None)
+        rendered = dict((field, getattr(article, field)) for field in ['title', 'punchline', 'rendered_html'])
+        self.assertEqual(rendered, {'title': 'AT&amp;T', 'punchline': 'A<br />\nbreak',
+                                    'rendered_html': '\n\n\n<h2>Section</h2>\n<hr />'})
+        # As the BeautifulSoup extraction used to store them
+        Article.objects.filter(pk=article.pk)\
+            .update(punchline='A<br/>\nbreak', rendered_html='\n\n<h2>Section</h2>\n<hr/>')
+        Revision.objects.filter(article=article).update(punchline='A<br/>\nbreak', content_hash='')
+        out = StringIO()
+        call_command('rerender_articles', stdout=out)
+        self.assertIn('Rendered 1 articles and 1 revisions again', out.getvalue())
+        article = Article.objects.get(pk=article.pk)
+        self.assertEqual(dict((field, getattr(article, field)) for field in rendered), rendered)
+        self.assertEqual(article.revision_set.get().punchline, rendered['punchline'])
+        # Unchanged content still matches its revision
+        article.save()
+        self.assertEqual(article.revision_set.count(), 1)
+
     def test_revisions_can_be_diffed_against_current(self):
         article = G(Article, raw_content='# This is the title\n\nThis is the description with removed content',
                     deleted_at=None, rendered_html='')
@@ -630,6 +1086,29 @@ class TestArticleViews(WebTest):
         # The diff should be a list of 3-tuples with (status, left, right)
         self.assertEqual(len(response.context['diff']), 5)  # There are five lines -- three content and two empty lines
 
+    def test_revision_diffs_are_cached_until_the_article_changes(self):
+        article = G(Article, raw_content='# Title\n\nFirst line\nSecond line', deleted_at=None, rendered_html='')
+        revision = article.revision_set.get()
+        article.raw_content = '# Title\n\nFirst line\nSecond line, edited'
+        article.save()
+        url = reverse('articles_article_revision_diff', args=(article.pk, revision.pk))
+        diff = self.app.get(url).context['diff']
+        self.assertEqual(diff[-1], (True, 'Second line', 'Second line<ins>, edited</ins>'))
+        with mock.patch('articles.views.side_by_side_diff') as side_by_side_diff:
+            self.assertEqual(self.app.get(url).context['diff'], diff)
+            self.assertFalse(side_by_side_diff.called)
+        # A new revision makes for a different diff
+        article.raw_content = '# Title\n\nFirst line'
+        article.save()
+        self.assertEqual(len(self.app.get(url).context['diff']), 4)
+        # And so does going back to an earlier version, which adds no revision
+        article.raw_content = '# Title\n\nFirst line\nSecond line, edited'
+        article.save()
+        self.assertEqual(self.app.get(url).context['diff'], diff)
+        article.raw_content = '# Title\n\nFirst line\nSecond line'
+        article.save()
+        self.assertFalse(any(changed for changed, left, right in self.app.get(url).context['diff']))
+
     def test_saving_articles_increments_editors_and_revisions_count(self):
         a = G(Article)
         first_author = a.author
@@ -658,6 +1137,20 @@ class TestArticleViews(WebTest):
         self.assertEqual(previous_revisions_count+3, a.revisions_count)  # sanity check
         self.assertEqual(a.editors_count, 2)
 
+    def test_existing_revisions_are_found_by_content_hash(self):
+        a = G(Article, raw_content='# Title\n\nFirst version')
+        a.raw_content = '# Title\n\nSecond version'
+        a.save()
+        hashes = list(a.revision_set.values_list('content_hash', flat=True))
+        self.assertEqual(len(set(hashes)), 2)
+        self.assertTrue(all(len(h) == 40 for h in hashes))
+        # Going back to a previous version matches the revision already stored for it
+        revisions_count = a.revisions_count
+        a.raw_content = '# Title\n\nFirst version'
+        a.save()
+        self.assertEqual(a.revisions_count, revisions_count)
+        self.assertEqual(a.revision_set.count(), 2)
+
     def test_article_create_update_views_use_correct_form(self):
         url = reverse('articles_article_create')
         response = self.app.get(url, user='someuser')
@@ -760,6 +1253,67 @@ Paragraph introduction **markup**.
 """
         self.user = G(get_user_model(), username="test_username")
 
+    def legacy_process_raw_content(self, raw_content):
+        # This is how process_raw_content used to work, re-parsing the rendered HTML
+        data = {'full_rendered_content': markdown(raw_content)}
+        soup = BeautifulSoup(data['full_rendered_content'])
+        try:
+            data['title'] = soup.find('h1').extract().encode_contents()
+        except AttributeError:
+            data['title'] = ''
+        try:
+            data['punchline'] = soup.find('blockquote').extract().find('p').encode_contents().strip()
+        except AttributeError:
+            data['punchline'] = ''
+        try:
+            data['description'] = soup.find('h2').find_previous('p').extract().encode_contents()
+        except AttributeError:
+            data['description'] = ''
+        data['rendered_html'] = soup.encode_contents()
+        return data
+
+    def test_rendering_matches_the_previous_beautifulsoup_extraction(self):
+        corpus = [
+            self.sample_meta + self.sample_content,
+            self.sample_content,
+            self.sample_meta,
+            '# The Title\n\n> The **punchline**\n\nThe **intro**\n\n\n## The rendered HTML',
+            '# The Title\n\n> The **punchline**\n\n## The rendered HTML\n\nWith a p',
+            '# Title\n\n> Punchline\n\nIntro\n\nSome *content*',
+            '# Changed Title\n\n> New Punchline\n\nAnother Intro\n\nSome fresh *content*',
+            '# This is the title\n\nThis is the description with removed content',
+            '# Some raw content\n\n http://devcharm.com',
+            'random gibberish',
+            '> Only a quote\n\n- a list\n- with *items*\n\n## Heading\n\n1. and\n2. more',
+            '',
+        ]
+        for raw_content in corpus:
+            self.assertEqual(self.legacy_process_raw_content(raw_content), render_article_content(raw_content))
+
+    def test_rendering_matches_the_previous_beautifulsoup_extraction_but_for_serialization(self):
+        # Void elements, entities and non-ASCII text are serialized differently, but the markup is the same
+        corpus = [
+            u'# Line  \nbreaks\n\n> A punchline  \nover two lines\n\nAn intro  \nwith a break\n\n'
+            u'## Section\n\nText  \nmore',
+            u'# Title\n\n> Punchline\n\nIntro\n\n---\n\n## Section\n\n***\n\nEnd',
+            u'# Title\n\nIntro with ![an image](http://example.com/a.png "Image")\n\n## Section\n\n![alt](/b.png)',
+            u'# Title\n\n> See [this](http://example.com/?a=1&b=2)\n\nIntro [link](http://example.com/?q=x&y=z)\n\n'
+            u'## S\n\nAT&T, &copy; and <http://example.com/?a&b>',
+            u'# Caff\xe8 & cr\xe8me br\xfbl\xe9e\n\n> Gi\xe0 fatto\n\nL\'introduzione \xe8 qui\n\n'
+            u'## Sezione \u2014 due\n\n\xdcber \u201cquotes\u201d',
+        ]
+        normalize = lambda html: BeautifulSoup(html).encode_contents()
+        for raw_content in corpus:
+            legacy, data = self.legacy_process_raw_content(raw_content), render_article_content(raw_content)
+            self.assertEqual(legacy['full_rendered_content'], data['full_rendered_content'])
+            for field in ['title', 'punchline', 'description', 'rendered_html']:
+                self.assertIsInstance(data[field], unicode)
+                self.assertEqual(normalize(legacy[field]), normalize(data[field]))
+        data = render_article_content(corpus[0])
+        self.assertEqual(data['punchline'], u'A punchline<br />\nover two lines')
+        self.assertEqual(data['rendered_html'], u'\n<p>breaks</p>\n\n\n<h2>Section</h2>\n<p>Text<br />\nmore</p>')
+        self.assertEqual(render_article_content(corpus[4])['title'], u'Caff\xe8 &amp; cr\xe8me br\xfbl\xe9e')
+
     def test_articleform_transforms_rawcontent_to_fields_to_allow_saving(self):
         raw_content = self.sample_meta + self.sample_content
         form = ArticleForm(data={'author': self.user.pk, 'raw_content': raw_content})
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+from collections import Counter, defaultdict
+import atexit
+import logging
+import threading
+import time
+from django.conf import settings
+from django.db import DatabaseError, DataError, IntegrityError
+from django.db.models import F
+from django.db.transaction import atomic
+from articles.models import Article, ArticleView
+
+
+logger = logging.getLogger(__name__)
+
+
+class ArticleViewBuffer(object):
+    """
+    Collects article views in memory and writes them in batches.
+
+    Every flush results in a single bulk INSERT of the ArticleView records plus one UPDATE for each distinct increment
+    of views_count, so popular articles don't get their row locked on every single page view. The counters are
+    eventually consistent: views are flushed when the buffer is full, when the flush interval has elapsed or when the
+    process exits.
+    """
+    def __init__(self, max_size=None, flush_interval=None, max_pending=None):
+        self.max_size = max_size or settings.ARTICLE_VIEWS_BUFFER_SIZE
+        self.flush_interval = flush_interval or settings.ARTICLE_VIEWS_FLUSH_INTERVAL
+        self.max_pending = max_pending or settings.ARTICLE_VIEWS_MAX_PENDING
+        self.lock = threading.Lock()
+        self.pending = []
+        self.last_flush = time.time()
+
+    def record(self, article, session_id='', user=None):
+        with self.lock:
+            self.pending.append(ArticleView(article_id=article.pk, session_id=session_id, user=user))
+            should_flush = len(self.pending) >= self.max_size or time.time() - self.last_flush >= self.flush_interval
+        if should_flush:
+            # This runs in some visitor's request, which mustn't fail because of the views of others
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Could not write the buffered article views, %d are waiting', len(self.pending))
+
+    def write(self, views):
+        with atomic():
+            ArticleView.objects.bulk_create(views)
+            # Articles that received the same number of views can share the same UPDATE
+            by_increment = defaultdict(list)
+            for article_id, count in Counter(view.article_id for view in views).items():
+                by_increment[count].append(article_id)
+            for count, article_ids in by_increment.items():
+                Article.all_objects.filter(pk__in=article_ids).update(views_count=F('views_count') + count)
+
+    def requeue(self, views):
+        """
+        Put views back in front of the buffer to write them later, dropping the oldest beyond max_pending.
+        """
+        with self.lock:
+            self.pending[:0] = views
+            dropped = max(len(self.pending) - self.max_pending, 0)
+            del self.pending[:dropped]
+        if dropped:
+            logger.error('Dropped %d buffered article views, since they could not be written', dropped)
+
+    def flush(self):
+        """
+        Write the buffered views to the database.
+
+        When the batch can't be written because of some of its views (say, of an article deleted meanwhile), the
+        views are written one by one and the offending ones are dropped; on any other error (say, the database being
+        unreachable) the views are put back in the buffer to be retried, and the error is raised.
+
+        :return: the number of views written
+        :rtype: int
+        """
+        with self.lock:
+            pending, self.pending = self.pending, []
+            self.last_flush = time.time()
+        if not pending:
+            return 0
+        try:
+            self.write(pending)
+            return len(pending)
+        except (IntegrityError, DataError):
+            logger.warning('Could not write %d buffered article views at once, writing them one by one', len(pending))
+        except Exception:
+            self.requeue(pending)
+            raise
+        written = 0
+        for position, view in enumerate(pending):
+            try:
+                self.write([view])
+                written += 1
+            except (IntegrityError, DataError):
+                logger.exception('Dropped a view of article %s, since it could not be written', view.article_id)
+            except Exception:
+                self.requeue(pending[position:])
+                raise
+        return written
+
+    def flush_on_exit(self):
+        try:
+            self.flush()
+        except DatabaseError:
+            logger.exception('Could not write %d buffered article views', len(self.pending))
+
+
+article_views = ArticleViewBuffer()
+atexit.register(article_views.flush_on_exit)
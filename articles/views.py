@@ -1,23 +1,30 @@
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
-from django.forms import model_to_dict
-from django.http import HttpResponse, HttpResponseNotAllowed
+from django.core.cache import cache
+from django.db.models import Max, Q
+from django.http import HttpResponse, HttpResponseNotAllowed, Http404
 from django.http.response import HttpResponseForbidden, HttpResponseNotFound
 from django.shortcuts import get_object_or_404, redirect
 from django.template import loader
 from django.template.loader import get_template
 from django.utils.decorators import method_decorator
+from django.utils.encoding import iri_to_uri
+from django.utils.http import urlencode
 from django.utils.timezone import now
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from django.views.generic import CreateView, UpdateView, ListView, View
 from django.views.generic.detail import DetailView
 from django.views.generic.edit import ProcessFormView, ModelFormMixin
+import hashlib
 import json
+from articles.conditional import conditional_view, make_etag
 from articles.diff import side_by_side_diff
 from articles.forms import ArticleForm
-from articles.models import Article, ArticleGroup, Revision
+from articles.models import Article, ArticleGroup, Revision, DIFF_CACHE_KEY, PAGE_CACHE_KEY
+from articles.pagination import KeysetPaginationMixin, InvalidCursor, paginate_by_keyset
+from articles.rendering import content_hash
+from articles.tracking import article_views
 from tags.models import Tag
 
 
@@ -52,64 +59,47 @@ class ArticleDetailView(DetailView):
     def get_queryset(self):
         return Article.objects.get_queryset_for_user(self.request.user)
 
+    def get_validators(self):
+        """
+        Return the ETag and Last-Modified values of the page, from a single query on the article and its revisions.
+
+        The page itself varies with the user, the kudos count and the related content, so it only gets an ETag; the
+        source only changes with the article, so it gets a Last-Modified too.
+        """
+        row = self.get_queryset().filter(pk=self.kwargs['pk']).annotate(latest_revision=Max('revision'))\
+            .values_list('updated_at', 'received_kudos_count', 'latest_revision').first()
+        if row is None:
+            return None, None  # Let the view 404
+        updated_at, received_kudos_count, latest_revision = row
+        if self.as_source:
+            return make_etag(self.kwargs['pk'], updated_at, latest_revision), updated_at
+        return make_etag(self.kwargs['pk'], updated_at, latest_revision, received_kudos_count,
+                         self.kwargs.get('revision_id'), self.request.user.pk,
+                         Article.objects.get_page_cache_generation()), None
+
     def get(self, request, *args, **kwargs):
-        response = super(ArticleDetailView, self).get(request, *args, **kwargs)
+        etag, last_modified = self.get_validators()
+        view = conditional_view(super(ArticleDetailView, self).get, etag, last_modified)
+        response = view(request, *args, **kwargs)
         request_user = None
         if request.user.is_authenticated():
             request_user = request.user
-        self.object.receive_view(session_id=request.COOKIES.get(settings.SESSION_COOKIE_NAME, ''),
-                                 user=request_user)
+        # Views are counted even when the page is not sent again, and then the article is not loaded at all
+        article = self.object if response.status_code != 304 else Article(pk=int(self.kwargs['pk']))
+        article_views.record(article, session_id=request.COOKIES.get(settings.SESSION_COOKIE_NAME, ''),
+                             user=request_user)
         return response
 
-    def get_related_context_data(self, main_tag):
-        context_data = {}
-        queryset_for_user = Article.objects.get_queryset_for_user(self.request.user)
-        # Other articles with the same primary tag
-        read_more = queryset_for_user.filter(tags=main_tag).exclude(pk=self.object.pk)
-        context_data['read_more'] = read_more
-        # related tags and articles depend on the main tag
-        related_tags = Article.objects_as_tagged.get_tags_by_count(read_more).exclude(title=main_tag.title)
-        alt_primary_related_tags = related_tags.exclude(tag_type=main_tag.tag_type).filter(
-            tag_type__in=Tag.PRIMARY_TYPES)
-        padding_tags = list(Article.objects_as_tagged.get_tags_by_count().exclude(title=main_tag.title).exclude(
-            title__in=alt_primary_related_tags.values_list('title', flat=True)))
-        # Since we need to run it twice, it makes sense to evaluate it once
-        alt_primary_related_tags = list(alt_primary_related_tags)
-        try:
-            context_data['related_tag_one'] = (alt_primary_related_tags + padding_tags)[0]
-        except IndexError:
-            pass
-        else:
-            context_data['related_articles_one'] = queryset_for_user.filter(
-                tags=context_data['related_tag_one']).exclude(pk__in=read_more.values_list('pk', flat=True))
-            try:
-                context_data['related_tag_two'] = (alt_primary_related_tags + padding_tags)[1]
-            except IndexError:
-                pass
-            else:
-                context_data['related_articles_two'] = queryset_for_user.filter(
-                    tags=context_data['related_tag_two']).exclude(
-                        pk__in=read_more.values_list('pk', flat=True)).exclude(
-                            pk__in=context_data['related_articles_one'].values_list('pk', flat=True))
-        return context_data
-
     def get_context_data(self, **kwargs):
         context_data = super(ArticleDetailView, self).get_context_data(**kwargs)
         if 'revision_id' in self.kwargs:
             revision = get_object_or_404(self.object.revision_set, pk=self.kwargs['revision_id'])
-            revision_data = model_to_dict(revision, ['title', 'punchline', 'description', 'rendered_html',
-                                                     'raw_content'])
-            for key, value in revision_data.items():
-                setattr(context_data['article'], key, value)
-        context_data['read_more'] = Article.objects.none()
-        context_data['related_tag_one'] = None
-        context_data['related_articles_one'] = Article.objects.none()
-        context_data['related_tag_two'] = None
-        context_data['related_articles_two'] = Article.objects.none()
+            # The content of revisions is not made of model fields, so model_to_dict would leave it out
+            for key in ['title', 'punchline', 'description', 'rendered_html', 'raw_content']:
+                setattr(context_data['article'], key, getattr(revision, key))
         context_data['canonical_url'] = self.request.build_absolute_uri(self.object.get_canonical_url())
-        main_tag = context_data['object'].primary_tag
-        if main_tag is not None:
-            context_data.update(self.get_related_context_data(main_tag))
+        # read_more, related_tag_one/two and related_articles_one/two
+        context_data.update(Article.objects.get_related_content(self.object))
         return context_data
 
     def render_to_response(self, context, **response_kwargs):
@@ -253,13 +243,45 @@ class ArticleSetDeletedView(RESTLikeUpdateView):
         return super(ArticleSetDeletedView, self).post(request, *args, **kwargs)
 
 
-class ArticleListView(ListView):
+class AnonymousPageCacheMixin(object):
+    """
+    Serve anonymous visitors from a cache of the rendered page, keyed by path, query string and page cache generation.
+
+    Pages that use the CSRF token or set cookies are never cached, since those are bound to a single visitor.
+    """
+    def get_page_cache_key(self):
+        # Parameters are sorted, so that ?drilldown=a&drilldown=b and ?drilldown=b&drilldown=a share the same page
+        query = urlencode(sorted((key, sorted(values)) for key, values in self.request.GET.lists()), doseq=True)
+        path = hashlib.md5(iri_to_uri(self.request.path) + '?' + query).hexdigest()
+        return PAGE_CACHE_KEY.format(generation=Article.objects.get_page_cache_generation(), path=path)
+
+    def dispatch(self, request, *args, **kwargs):
+        if settings.DEBUG or request.method != 'GET' or request.user.is_authenticated():
+            return super(AnonymousPageCacheMixin, self).dispatch(request, *args, **kwargs)
+        key = self.get_page_cache_key()
+        content = cache.get(key)
+        if content is not None:
+            return HttpResponse(content)
+        response = super(AnonymousPageCacheMixin, self).dispatch(request, *args, **kwargs)
+        if response.status_code == 200 and hasattr(response, 'add_post_render_callback'):
+            response.add_post_render_callback(lambda rendered: self.cache_page(key, rendered))
+        return response
+
+    def cache_page(self, key, response):
+        if not self.request.META.get('CSRF_COOKIE_USED') and not response.cookies:
+            cache.set(key, response.content, settings.PAGE_CACHE_TIMEOUT)
+
+
+class ArticleListView(AnonymousPageCacheMixin, KeysetPaginationMixin, ListView):
     model = Article
     context_object_name = 'article_list'
 
+    def get_paginate_by(self, queryset):
+        return settings.ARTICLE_LIST_PAGE_SIZE
+
     def get_queryset(self):
         sort_key = self.request.GET.get('sort')
-        base_qs = Article.objects.get_queryset_for_user(self.request.user)
+        base_qs = Article.objects.get_queryset_for_user(self.request.user).for_listing()
         if sort_key == 'new':
             qs = base_qs.order_by('-published_at')
         elif sort_key == 'views':
@@ -275,77 +297,110 @@ class ArticleListView(ListView):
 
 class ArticleListByTagView(ArticleListView):
     main_tag = None
+    drilldown = ()
+    related_list_size = 6  # How many articles the sidebar shows for each related tag
 
     def get_queryset(self):
         self.main_tag = self.kwargs.get('tag')
-        qs = super(ArticleListByTagView, self).get_queryset().filter(tags__title=self.main_tag)
-        drilldown = [t for t in self.request.GET.getlist('drilldown') if t != self.main_tag]
-        for tag in drilldown:
-            qs = qs.filter(tags__title=tag)
-        return qs
-
-    def get_related_lists_context_data(self, context_data, main_pks, queryset_for_user):
+        self.drilldown = [t for t in self.request.GET.getlist('drilldown') if t != self.main_tag]
+        qs = super(ArticleListByTagView, self).get_queryset()
+        if not self.drilldown:
+            return qs.filter(tags__title=self.main_tag)
+        # Intersected by the tag postings index, instead of one join per tag (see the benchmark_drilldown command)
+        return qs.filter(pk__in=Article.objects_as_tagged.tagged_with_all_ids([self.main_tag] + self.drilldown))
+
+    def get_related_lists_context_data(self, related_tags, main_pks, queryset_for_user):
         related_lists = {
             'related_tag_one': None,
             'related_tag_two': None,
-            'related_articles_one': Article.objects.none(),
-            'related_articles_two': Article.objects.none(),
+            'related_articles_one': [],
+            'related_articles_two': [],
         }
-        related_tags = list(context_data['related_tags'].exclude(title=self.main_tag))
+        related_tags = [tag for tag in related_tags if tag.title != self.main_tag]
         if related_tags:
             related_lists['related_tag_one'] = related_tags[0]
-            related_list_one = queryset_for_user.filter(tags=related_lists['related_tag_one']).exclude(pk__in=main_pks)
+            related_list_one = list(queryset_for_user.filter(tags=related_tags[0]).exclude(pk__in=main_pks)[
+                :self.related_list_size])
             related_lists['related_articles_one'] = related_list_one
             if len(related_tags) > 1:
                 related_lists['related_tag_two'] = related_tags[1]
-                third_list_exclusions = main_pks + list(related_list_one.values_list('pk', flat=True))
-                related_list_two = queryset_for_user.filter(tags=related_lists['related_tag_two']).exclude(
-                    pk__in=third_list_exclusions)
-                related_lists['related_articles_two'] = related_list_two
+                third_list_exclusions = main_pks + [article.pk for article in related_list_one]
+                related_lists['related_articles_two'] = list(queryset_for_user.filter(tags=related_tags[1]).exclude(
+                    pk__in=third_list_exclusions)[:self.related_list_size])
         return related_lists
 
+    def get_tags_by_count(self, articles):
+        """
+        Count the tags of the given articles from their prefetched tags, like TaggableManager.get_tags_by_count does.
+        """
+        tags, counts = {}, {}
+        for article in articles:
+            for tag in article.tags.all():
+                tags[tag.pk] = tag
+                counts[tag.pk] = counts.get(tag.pk, 0) + 1
+        for pk, tag in tags.items():
+            tag.uses_count = counts[pk]
+        return sorted(tags.values(), key=lambda tag: tag.uses_count, reverse=True)
+
     def get_context_data(self, **kwargs):
         context_data = super(ArticleListByTagView, self).get_context_data(**kwargs)
-        article_list = context_data['article_list']
-
-        # The following is not pretty but I see no other way of ensuring all the tags are present, since we're
-        # filtering on the tag in the main queryset
-        # Also: note that evaluating the queryset here avoids hitting the DB again later on
-        queryset_for_user = Article.objects.get_queryset_for_user(self.request.user)
-        main_pks = list(article_list.values_list('pk', flat=True))  # Evaluate once
-        context_data['related_tags'] = Article.objects_as_tagged.get_tags_by_count(
-            queryset_for_user.filter(pk__in=main_pks))
-
-        wip = self.get_queryset().filter(tags__title=Tag.WIP_TAG)
-        context_data['wip_articles'] = wip
+        # The main queryset is evaluated only here, with its tags prefetched: everything else is derived from it
+        articles = list(context_data['article_list'])
+        main_pks = [article.pk for article in articles]
+        tags_by_count = self.get_tags_by_count(articles)
+        main_tag = None
+        if not self.drilldown:
+            main_tag = next((tag for tag in tags_by_count if tag.title == self.main_tag), None) or \
+                Tag.objects.filter(title=self.main_tag).first()
+        if main_tag is not None:
+            # The related tags are simply the ones most often used together with the main tag
+            context_data['related_tags'] = [main_tag] + main_tag.related()
+        else:
+            context_data['related_tags'] = tags_by_count
 
-        # FIXME: I am not loving this way of removing the articles preent in the WIP list; refactor ASAP.
-        context_data['article_list'] = article_list.exclude(pk__in=wip.values_list('pk', flat=True))
+        context_data['wip_articles'] = [article for article in articles if article.is_wip]
+        context_data['article_list'] = [article for article in articles if not article.is_wip]
         context_data['main_tag'] = self.main_tag
 
-        related_lists = self.get_related_lists_context_data(context_data, main_pks, queryset_for_user)
-        context_data.update(related_lists)
+        queryset_for_user = Article.objects.get_queryset_for_user(self.request.user).for_listing()
+        context_data.update(self.get_related_lists_context_data(context_data['related_tags'], main_pks,
+                                                                queryset_for_user))
         return context_data
 
 
 class ArticleListHomepageView(ArticleListView):
     template_name = 'landing.html'
 
+    def get_paginate_by(self, queryset):
+        return settings.HOMEPAGE_NUM_HOT_ARTICLES
+
+    def get_new_articles(self):
+        try:
+            queryset = Article.objects.get_queryset_for_user().for_listing().order_by('-published_at')
+            return paginate_by_keyset(queryset, self.request.GET.get('new_cursor'), settings.HOMEPAGE_NUM_NEW_ARTICLES)
+        except InvalidCursor:
+            raise Http404
+
     def get_context_data(self, **kwargs):
         context_data = super(ArticleListHomepageView, self).get_context_data(**kwargs)
         context_data['editors_picks'] = ArticleGroup.objects.get_editors_picks(self.request.user)
         context_data['wip_articles'] = ArticleGroup.objects.get_promoted_wip(self.request.user)
-        context_data['new_articles'] = Article.objects.get_queryset_for_user().order_by('-published_at')
+        context_data['new_articles'] = self.get_new_articles()
         context_data['trending_tags'] = Article.objects.get_trending_tags()
         return context_data
 
 
-class ArticleRevisionListView(ListView):
+class ArticleRevisionListView(KeysetPaginationMixin, ListView):
     model = Revision
     main_object = None
 
+    def get_paginate_by(self, queryset):
+        return settings.REVISION_LIST_PAGE_SIZE
+
     def get_queryset(self):
-        return self.main_object.revision_set.all()
+        # Only what the history shows: the content of the revisions can be large, and it's not needed here
+        return self.main_object.revision_set.select_related('author__author_profile')\
+            .only('article', 'author', 'created_at', 'title', 'lines_added', 'lines_removed')
 
     def get(self, request, *args, **kwargs):
         self.main_object = get_object_or_404(Article.objects.get_queryset_for_user(self.request.user),
@@ -372,5 +427,16 @@ class ArticleRevisionDiffView(DetailView):
         context_data = super(ArticleRevisionDiffView, self).get_context_data(**kwargs)
         context_data['article'] = self.revision.article
         context_data['revision'] = self.revision
-        context_data['diff'] = list(side_by_side_diff(self.revision.raw_content, self.object.raw_content))
+        context_data['diff'] = self.get_diff()
         return context_data
+
+    def get_diff(self):
+        """
+        Return the side-by-side diff of the revision against the current version, cached until the article changes.
+        """
+        key = DIFF_CACHE_KEY.format(revision_id=self.revision.pk, content_hash=content_hash(self.object.raw_content))
+        diff = cache.get(key)
+        if diff is None:
+            diff = list(side_by_side_diff(self.revision.raw_content, self.object.raw_content))
+            cache.set(key, diff, settings.DIFF_CACHE_TIMEOUT)
+        return diff
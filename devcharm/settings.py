@@ -153,6 +153,7 @@ TEMPLATE_CONTEXT_PROCESSORS = (
     'django.core.context_processors.request',
     'django.contrib.messages.context_processors.messages',
     'social.apps.django_app.context_processors.backends',
+    'articles.context_processors.page_cache',
 )
 
 AUTHENTICATION_BACKENDS = (
@@ -219,9 +220,67 @@ STATICFILES_STORAGE = 'pipeline.storage.PipelineStorage'
 # Output customization
 PROFILE_PAGE_NUM_SUGGESTED_WIP_ARTICLES = 10
 PROFILE_PAGE_NUM_SCORE_TRANSACTIONS = 15
+# Article lists are paginated by keyset (see articles.pagination); these are the page sizes
+PROFILE_PAGE_NUM_PUBLISHED_ARTICLES = 24
+PROFILE_PAGE_NUM_EDITED_ARTICLES = 12
+PROFILE_PAGE_NUM_DRAFTS = 24
+HOMEPAGE_NUM_HOT_ARTICLES = 9
+HOMEPAGE_NUM_NEW_ARTICLES = 20
+ARTICLE_LIST_PAGE_SIZE = 30
+REVISION_LIST_PAGE_SIZE = 50
+# Columns left out of article lists (see ArticleQuerySet.for_listing), loaded on access if a template needs them
+ARTICLE_LISTING_DEFERRED_FIELDS = ['raw_content', 'rendered_html', 'description', 'keywords']
+# Feeds are streamed, but only their latest items are included
+FEED_NUM_ARTICLES = 50
+FEED_NUM_REVISIONS = 50
 
 TOTAL_RANDOM_IMAGES = 12
 
+# Trending tags are cached for this long, and computed in the request whenever the cache is cold
+TRENDING_TAGS_CACHE_TIMEOUT = 60 * 60
+# With a cache shared by all the processes (like memcached, set up in local_settings), they can be warmed by the
+# warm_trending_tags command instead, run more often than the timeout (and every minute or so with --if-stale, to pick
+# up kudos and publications). With the default per-process LocMemCache the command would only fill its own cache
+TRENDING_TAGS_WARMING_ENABLED = False
+
+# Article views are buffered in memory and written when either limit is reached
+ARTICLE_VIEWS_BUFFER_SIZE = 100
+ARTICLE_VIEWS_FLUSH_INTERVAL = 30  # seconds
+# Views kept for retrying while the database can't take them; the oldest are dropped beyond this
+ARTICLE_VIEWS_MAX_PENDING = 10000
+
+# Number of rendered markdown documents kept in memory by Article.process_raw_content
+MARKDOWN_RENDER_CACHE_SIZE = 256
+
+# Related content for the article pages is indexed per article; the index is invalidated on tag/publish changes,
+# and expires anyway so that processes which don't share the cache catch up with them
+RELATED_CONTENT_INDEX_SIZE = 6  # articles per list, matching the longest list the templates show
+RELATED_CONTENT_CACHE_TIMEOUT = 60 * 15
+
+# The in-process tag postings index is rebuilt in the background when another process changes tags, at most once per
+# interval; until then, and whenever it's older than the max age, tag pages fall back to the database.
+# Processes find out about each other's changes through a version number in the default cache, so the index needs a
+# cache that all of them share (like memcached, set up in local_settings): with the default per-process LocMemCache
+# and more than one worker process, workers would serve stale results for up to the max age, so it's off unless
+# local_settings turns it on along with the shared cache
+TAG_POSTINGS_ENABLED = False
+TAG_POSTINGS_REBUILD_INTERVAL = 10  # seconds
+TAG_POSTINGS_MAX_AGE = 60 * 5
+
+# Homepage and tag pages are cached whole for anonymous visitors, and so are the page fragments that list articles;
+# both are dropped on changes and kudos to listed articles, and on changes to tags and groups, but views counts and
+# hotness decay only show up when they expire
+PAGE_CACHE_TIMEOUT = 60 * 5
+FRAGMENT_CACHE_TIMEOUT = 60 * 15
+
+# Revision diffs are cached per pair of revisions, which never change; the timeout bounds the character-level diff of
+# each changed hunk, after which diff_match_patch settles for a coarser diff
+DIFF_CACHE_TIMEOUT = 60 * 60 * 24
+DIFF_TIMEOUT = 1.0  # seconds
+
+# Revisions are stored as patches against a full copy of the content, which is made again every this many revisions
+REVISION_KEYFRAME_INTERVAL = 20
+
 ACTIVITY_POINTS = {
     'editing_article': 2,
     'adding_links': 10,
@@ -2,18 +2,31 @@
 # Project-level acceptance tests
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils.timezone import now
 from django.utils.unittest.case import skip
 from django_dynamic_fixture import G
 from django_webtest import WebTest
 from datetime import timedelta
 from urlparse import urlparse
-from articles.models import Article, ArticleGroup, Kudos
+import mock
+from articles.feeds import ArticleFeedGlobal
+from articles.models import Article, ArticleGroup, Kudos, Revision
 from tags.models import Tag
 
 
 class DevcharmContentTest(WebTest):
+    def setUp(self):
+        super(DevcharmContentTest, self).setUp()
+        cache.clear()  # Pages and generations cached by earlier tests would outlive their fixtures
+
+    def tearDown(self):
+        cache.clear()
+        super(DevcharmContentTest, self).tearDown()
+
     def assertTitlesEqual(self, response, items, ul_class):
         self.assertItemsEqual([item.title for item in items],
                               [element.string for element in response.html.select('ul.{} li h4 a'.format(ul_class))])
@@ -175,6 +188,74 @@ class TestHomePageContent(DevcharmContentTest):
         self.assertEqual(len(response.xml.findall('./channel/item')), 3)
 
 
+    def test_feeds_support_conditional_get(self):
+        t = G(Tag, title='sample-tag')
+        article = G(Article, tags=[t], deleted_at=None, published_at=now())
+        for url in [reverse('articles_feed_global'), reverse('articles_feed_by_tag', args=(t.title, )),
+                    reverse('articles_article_revision_feed', args=(article.pk, ))]:
+            response = self.app.get(url)
+            etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+            self.app.get(url, headers={'If-None-Match': etag}, status=304)
+            self.app.get(url, headers={'If-Modified-Since': last_modified}, status=304)
+        # Editing an article changes the feeds it's in
+        article.title = 'A different title'
+        article.save()
+        response = self.app.get(reverse('articles_feed_by_tag', args=(t.title, )), headers={'If-None-Match': etag},
+                                status=200)
+        self.assertIn('A different title', response)
+
+    def test_feed_validators_change_with_any_of_the_items(self):
+        t = G(Tag, title='sample-tag')
+        older = G(Article, tags=[t], deleted_at=None, published_at=now() - timedelta(days=1))
+        newer = G(Article, tags=[t], deleted_at=None, published_at=now())
+        url = reverse('articles_feed_by_tag', args=(t.title, ))
+
+        def assertFeedChanged():
+            response = self.app.get(url, headers={'If-None-Match': self.etag}, status=200)
+            self.etag = response.headers['ETag']
+
+        self.etag = self.app.get(url).headers['ETag']
+        older.tags.remove(t)
+        assertFeedChanged()
+        newer.author.author_profile.display_name = 'Someone else'
+        newer.author.author_profile.save()
+        assertFeedChanged()
+        older.tags.add(t)
+        assertFeedChanged()
+        older.deleted_at = now()
+        older.save()
+        assertFeedChanged()
+        oldest = G(Article, tags=[t], deleted_at=None, published_at=now() - timedelta(days=2))
+        assertFeedChanged()
+        oldest.published_at = None
+        oldest.save()
+        assertFeedChanged()
+
+    def test_feeds_are_streamed_up_to_their_limit(self):
+        articles = [G(Article, deleted_at=None, published_at=now() - timedelta(days=i)) for i in range(3)]
+        with mock.patch.object(ArticleFeedGlobal, 'item_limit', 2):
+            response = self.client.get(reverse('articles_feed_global'))
+            self.assertTrue(response.streaming)
+            response = self.app.get(reverse('articles_feed_global'))
+        items = response.xml.findall('./channel/item')
+        self.assertEqual([item.find('title').text for item in items], [a.title for a in articles[:2]])
+
+    def test_feeds_run_a_constant_number_of_queries(self):
+        def count_queries(url):
+            with CaptureQueriesContext(connection) as queries:
+                ''.join(self.client.get(url).streaming_content)
+            return len(queries)
+
+        article = G(Article, deleted_at=None, published_at=now())
+        G(Revision, article=article)
+        urls = [reverse('articles_feed_global'), reverse('articles_article_revision_feed', args=(article.pk, ))]
+        counts = [count_queries(url) for url in urls]
+        # More items, by different authors and by the same ones, don't take more queries
+        for author in G(get_user_model(), n=3):
+            G(Article, n=2, author=author, deleted_at=None, published_at=now())
+            G(Revision, n=2, article=article, author=author)
+        self.assertEqual([count_queries(url) for url in urls], counts)
+
 class TestArticleListContent(DevcharmContentTest):
     def test_articles_can_be_listed_by_tag(self):
         articles = G(Article, n=3, deleted_at=None)
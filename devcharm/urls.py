@@ -18,7 +18,7 @@ class TagsSitemap(GenericSitemap):
 
 sitemaps = {
     'pages': GenericSitemap({
-        'queryset': Article.objects.filter(published_at__isnull=False),
+        'queryset': Article.objects.filter(published_at__isnull=False).for_listing(),
         'date_field': 'published_at'
     }, priority=1.0),
 
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import NoArgsCommand
+from django.db import connection
+from django.db.transaction import atomic
+from articles.models import Article
+from profiles.models import Author
+
+
+# Each denormalized counter on Author, with the query that computes its actual value
+COUNTERS = {
+    'articles_published_count': "SELECT COUNT(*) FROM {article} "
+                                "WHERE {article}.original_author_id = {author}.user_id "
+                                "AND {article}.published_at IS NOT NULL AND {article}.deleted_at IS NULL",
+}
+
+
+class Command(NoArgsCommand):
+    help = 'Recomputes the denormalized counters on author profiles, fixing the ones that drifted.'
+
+    @atomic
+    def handle_noargs(self, **options):
+        cursor = connection.cursor()
+        for field, count_sql in sorted(COUNTERS.items()):
+            count_sql = count_sql.format(article=Article._meta.db_table, author=Author._meta.db_table)
+            cursor.execute("UPDATE {author} SET {field} = ({count}) WHERE {field} <> ({count})".format(
+                author=Author._meta.db_table, field=field, count=count_sql))
+            self.stdout.write('Fixed {} for {} authors'.format(field, cursor.rowcount))
@@ -1,8 +1,91 @@
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
-from django.db import models
+from django.db import models, connection
+from django.db.models import F
 from django.db.models.signals import post_save
+from django.db.transaction import atomic
+from collections import defaultdict, Counter
+from contextlib import contextmanager
+from functools import wraps
 import markdown
+import threading
+
+
+class AuthorManager(models.Manager):
+    def __init__(self):
+        super(AuthorManager, self).__init__()
+        self.batch = threading.local()
+
+    def update_counters(self, user_id, **changes):
+        """
+        Add the given deltas to the counters of a user's profile, touching only those columns.
+
+        Inside counters_batch() the deltas are accumulated per user, and written when the batch ends. Counters never
+        go below zero.
+        """
+        pending = getattr(self.batch, 'pending', None)
+        if pending is None:
+            self.apply_counter_changes(user_id, changes)
+        else:
+            pending[user_id].update(changes)
+
+    def apply_counter_changes(self, user_id, changes):
+        increments = dict((field, F(field) + change) for field, change in changes.items() if change > 0)
+        if increments:
+            self.filter(user=user_id).update(**increments)
+        for field, change in changes.items():
+            if change < 0:
+                # Counters can't go below zero: drift is left to the reconcile command, rather than to the constraint
+                self.filter(user=user_id, **{field + '__gte': -change}).update(**{field: F(field) + change})
+
+    def update_counter_in_bulk(self, field, changes):
+        """
+        Add a (possibly different) delta to the same counter of several users, with a single UPDATE.
+
+        :param changes: dict of user id -> delta
+        :return: the number of updated profiles
+        """
+        if not changes:
+            return 0
+        sql = 'UPDATE {table} SET {field} = {field} + changes.delta ' \
+              'FROM (VALUES {values}) AS changes (user_id, delta) ' \
+              'WHERE {table}.user_id = changes.user_id AND {table}.{field} + changes.delta >= 0'.format(
+                  table=self.model._meta.db_table, field=field, values=', '.join(['(%s, %s)'] * len(changes)))
+        cursor = connection.cursor()
+        cursor.execute(sql, [value for change in changes.items() for value in change])
+        return cursor.rowcount
+
+    @contextmanager
+    def counters_batch(self):
+        """
+        Run the block atomically, accumulating its counter changes and writing them once per user at its end.
+
+        The changes are written inside the block's transaction, so they are committed (or rolled back) together with
+        the writes they account for. A nested batch hands its changes to the outer one, unless it fails.
+        """
+        with atomic():
+            outer, self.batch.pending = getattr(self.batch, 'pending', None), defaultdict(Counter)
+            try:
+                yield
+                pending = self.batch.pending
+            finally:
+                self.batch.pending = outer
+            for user_id, changes in pending.items():
+                if outer is None:
+                    self.apply_counter_changes(user_id, changes)
+                else:
+                    outer[user_id].update(changes)
+
+
+def batch_counters(func):
+    """
+    Decorator running the function in a counters batch (see AuthorManager.counters_batch()).
+    """
+    @wraps(func)
+    def inner(*args, **kwargs):
+        with Author.objects.counters_batch():
+            return func(*args, **kwargs)
+    return inner
 
 
 class Author(models.Model):
@@ -16,12 +99,24 @@ class Author(models.Model):
     edits_count = models.PositiveIntegerField(default=0)
     kudos_given_count = models.PositiveIntegerField(default=0)
 
+    objects = AuthorManager()
+
     def __unicode__(self):
         return self.display_name
 
     def get_absolute_url(self):
         return reverse('profiles_profile', kwargs={'username': self.username})
 
+    def update_counters(self, **changes):
+        """
+        Apply deltas to the counters of this profile, both on the instance and (possibly batched) in the database.
+
+        Use this instead of incrementing the fields and saving, so that concurrent changes are not lost.
+        """
+        for field, change in changes.items():
+            setattr(self, field, getattr(self, field) + change)
+        Author.objects.update_counters(self.user_id, **changes)
+
     @property
     def username(self):
         return self.user.username
@@ -1,12 +1,16 @@
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
-from django.db import models
+from django.db import connection, models
+from django.db.models import F
 from django.test import TestCase
-from django.test.utils import override_settings
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils.timezone import now
 from django_dynamic_fixture import G
 from django_webtest import WebTest
 from datetime import timedelta
+from StringIO import StringIO
 from articles.models import Article
 from profiles.models import Author
 from scoring.models import ScoreTransaction
@@ -53,6 +57,85 @@ class TestProfileModel(TestCase):
         articles[2].receive_kudos(session_id='something', user=u2)
         self.assertEqual(Author.objects.get(pk=u2.author_profile.pk).kudos_given_count, 1)
 
+    def test_published_count_follows_publication_transitions(self):
+        user = G(get_user_model())
+        articles = G(Article, author=user, deleted_at=None, published_at=None, n=3)
+        self.assertEqual(Author.objects.get(user=user).articles_published_count, 0)
+        for article in articles:
+            article.published_at = now()
+            article.save()
+        self.assertEqual(Author.objects.get(user=user).articles_published_count, 3)
+        # Edits that don't change the publication state don't touch the counter
+        articles[0].raw_content = 'changed'
+        articles[0].save()
+        self.assertEqual(Author.objects.get(user=user).articles_published_count, 3)
+        # Deleting articles, either softly or for good, takes them out of the count
+        articles[1].deleted_at = now()
+        articles[1].save()
+        self.assertEqual(Author.objects.get(user=user).articles_published_count, 2)
+        articles[2].delete()
+        self.assertEqual(Author.objects.get(user=user).articles_published_count, 1)
+
+    def test_counters_are_updated_in_place(self):
+        author = G(get_user_model()).author_profile
+        # Somebody else changes the same profile meanwhile
+        Author.objects.filter(pk=author.pk).update(display_name='Changed', edits_count=F('edits_count') + 5)
+        with self.assertNumQueries(1):
+            author.update_counters(edits_count=1, kudos_given_count=2)
+        self.assertEqual((author.edits_count, author.kudos_given_count), (1, 2))  # The instance is kept up to date
+        fresh = Author.objects.get(pk=author.pk)
+        self.assertEqual((fresh.display_name, fresh.edits_count, fresh.kudos_given_count), ('Changed', 6, 2))
+
+    def test_counter_updates_can_be_batched(self):
+        u1, u2 = G(get_user_model(), n=2)
+        with CaptureQueriesContext(connection) as queries:
+            with Author.objects.counters_batch():
+                u1.author_profile.update_counters(edits_count=1)
+                with Author.objects.counters_batch():  # Nested batches are written by the outermost one
+                    u1.author_profile.update_counters(edits_count=1, score=3)
+                Author.objects.update_counters(u2.pk, kudos_given_count=1)
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE')]), 2)  # One per author
+        self.assertEqual(Author.objects.get(user=u1).edits_count, 2)
+        self.assertEqual(Author.objects.get(user=u1).score, 4)
+        self.assertEqual(Author.objects.get(user=u2).kudos_given_count, 1)
+
+    def test_counter_batches_go_with_their_transaction(self):
+        user = G(get_user_model())
+        with self.assertRaises(ValueError):
+            with Author.objects.counters_batch():
+                Author.objects.update_counters(user.pk, edits_count=1)
+                raise ValueError
+        self.assertEqual(Author.objects.get(user=user).edits_count, 0)
+        # A nested batch that fails drops its own changes only, and a batch left behind is never picked up again
+        with Author.objects.counters_batch():
+            Author.objects.update_counters(user.pk, edits_count=1)
+            try:
+                with Author.objects.counters_batch():
+                    Author.objects.update_counters(user.pk, edits_count=5)
+                    raise ValueError
+            except ValueError:
+                pass
+        Author.objects.update_counters(user.pk, edits_count=1)
+        self.assertEqual(Author.objects.get(user=user).edits_count, 2)
+
+    def test_counters_do_not_go_below_zero(self):
+        user = G(get_user_model())
+        Author.objects.update_counters(user.pk, edits_count=-1, kudos_given_count=1)
+        Author.objects.update_counter_in_bulk('articles_published_count', {user.pk: -1})
+        fresh = Author.objects.get(user=user)
+        self.assertEqual((fresh.edits_count, fresh.kudos_given_count, fresh.articles_published_count), (0, 1, 0))
+
+    def test_reconcile_command_fixes_drifted_counters(self):
+        u1, u2 = G(get_user_model(), n=2)
+        G(Article, author=u1, deleted_at=None, published_at=now(), n=2)
+        G(Article, author=u2, deleted_at=None, published_at=now())
+        Author.objects.filter(user=u1).update(articles_published_count=10)
+        out = StringIO()
+        call_command('reconcile', stdout=out)
+        self.assertIn('Fixed articles_published_count for 1 authors', out.getvalue())
+        self.assertEqual(Author.objects.get(user=u1).articles_published_count, 2)
+        self.assertEqual(Author.objects.get(user=u2).articles_published_count, 1)
+
 
 class TestProfileView(WebTest):
     def test_profile_view_defaults_to_current_user(self):
@@ -134,6 +217,16 @@ class TestProfileView(WebTest):
         self.assertIn('recent_articles_edited', response.context)
         self.assertItemsEqual(response.context['recent_articles_edited'], created)
 
+    @override_settings(PROFILE_PAGE_NUM_PUBLISHED_ARTICLES=3)
+    def test_profile_page_lists_are_paginated(self):
+        u = G(get_user_model())
+        created = G(Article, n=5, deleted_at=None, author=u)
+        response = self.app.get(reverse('profiles_profile', args=(u.username,)))
+        self.assertSequenceEqual(response.context['recent_articles_published'], created[:-4:-1])
+        response = response.click('load more')
+        self.assertSequenceEqual(response.context['recent_articles_published'], created[1::-1])
+        self.assertFalse(response.context['recent_articles_published'].has_next())
+
     def test_profile_page_includes_own_drafts(self):
         u = G(get_user_model())
         drafts = G(Article, n=5, deleted_at=None, author=u, published_at=None)
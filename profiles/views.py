@@ -6,6 +6,7 @@ from django.http import Http404, HttpResponseRedirect
 from django.shortcuts import get_object_or_404, redirect, render
 from django.views.generic import DetailView, UpdateView
 from articles.models import Article
+from articles.pagination import InvalidCursor, paginate_by_keyset
 from profiles.models import Author
 
 
@@ -49,22 +50,34 @@ class ProfileDetailView(DetailView):
         """
         return self.request.user != self.object
 
+    def paginate(self, queryset, cursor_param, page_size):
+        try:
+            return paginate_by_keyset(queryset, self.request.GET.get(cursor_param), page_size)
+        except InvalidCursor:
+            raise Http404
+
     def get_published_articles(self):
-        return self.object.created_articles.filter(published_at__isnull=False, deleted_at__isnull=True).order_by('-pk')
+        qs = self.object.created_articles.filter(published_at__isnull=False, deleted_at__isnull=True).for_listing()\
+            .order_by('-pk')
+        return self.paginate(qs, 'published_cursor', settings.PROFILE_PAGE_NUM_PUBLISHED_ARTICLES)
 
     def get_edited_articles(self):
-        return self.object.article_set.filter(published_at__isnull=False, deleted_at__isnull=True).order_by('-pk')
+        qs = self.object.article_set.filter(published_at__isnull=False, deleted_at__isnull=True).for_listing()\
+            .order_by('-pk')
+        return self.paginate(qs, 'edited_cursor', settings.PROFILE_PAGE_NUM_EDITED_ARTICLES)
 
     def get_drafts(self):
-        return self.object.article_set.filter(published_at__isnull=True, deleted_at__isnull=True).order_by('-pk')
+        qs = self.object.article_set.filter(published_at__isnull=True, deleted_at__isnull=True).for_listing()\
+            .order_by('-pk')
+        return self.paginate(qs, 'drafts_cursor', settings.PROFILE_PAGE_NUM_DRAFTS)
 
     def get_suggested_wip_articles(self):
         limit = settings.PROFILE_PAGE_NUM_SUGGESTED_WIP_ARTICLES
-        return Article.objects.get_wip_articles().order_by('-received_kudos_count')[:limit]
+        return Article.objects.get_wip_articles().for_listing().order_by('-received_kudos_count')[:limit]
 
     def get_recent_kudos(self):
         kudoed_articles = self.object.kudos_given.values_list('article', flat=True)
-        return Article.objects.filter(pk__in=kudoed_articles)
+        return Article.objects.filter(pk__in=kudoed_articles).for_listing()
 
     def get_context_data(self, **kwargs):
         context_data = super(ProfileDetailView, self).get_context_data(**kwargs)
@@ -11,9 +11,7 @@ class ScoreTransaction(models.Model):
     @transaction.atomic
     def save(self, *args, **kwargs):
         super(ScoreTransaction, self).save(*args, **kwargs)
-        profile = self.user.author_profile
-        profile.score += self.change
-        profile.save()
+        self.user.author_profile.update_counters(score=self.change)
 
     def __unicode__(self):
         return u'{operation}: {change} points change'.format(operation=self.operation, change=self.change)
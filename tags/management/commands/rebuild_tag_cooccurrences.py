@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import NoArgsCommand
+from tags.models import TagCooccurrence
+
+
+class Command(NoArgsCommand):
+    help = 'Recomputes the tag co-occurrence counts from the tags of the objects they count, fixing any drift.'
+
+    def handle_noargs(self, **options):
+        pairs = TagCooccurrence.objects.rebuild()
+        self.stdout.write('Counted {} pairs of tags'.format(pairs))
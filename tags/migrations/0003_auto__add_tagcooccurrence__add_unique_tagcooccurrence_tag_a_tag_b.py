@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'TagCooccurrence'
+        db.create_table(u'tags_tagcooccurrence', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('tag_a', self.gf('django.db.models.fields.related.ForeignKey')(related_name='cooccurrences', to=orm['tags.Tag'])),
+            ('tag_b', self.gf('django.db.models.fields.related.ForeignKey')(related_name='+', to=orm['tags.Tag'])),
+            ('count', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+        ))
+        db.send_create_signal(u'tags', ['TagCooccurrence'])
+
+        # Adding unique constraint on 'TagCooccurrence', fields ['tag_a', 'tag_b']
+        db.create_unique(u'tags_tagcooccurrence', ['tag_a_id', 'tag_b_id'])
+
+
+    def backwards(self, orm):
+        # Removing unique constraint on 'TagCooccurrence', fields ['tag_a', 'tag_b']
+        db.delete_unique(u'tags_tagcooccurrence', ['tag_a_id', 'tag_b_id'])
+
+        # Deleting model 'TagCooccurrence'
+        db.delete_table(u'tags_tagcooccurrence')
+
+
+    models = {
+        u'tags.tag': {
+            'Meta': {'object_name': 'Tag'},
+            'description': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'tag_type': ('django.db.models.fields.CharField', [], {'max_length': '32'}),
+            'title': ('django.db.models.fields.SlugField', [], {'unique': 'True', 'max_length': '50'}),
+            'updated': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'verbose_title': ('django.db.models.fields.CharField', [], {'max_length': '50', 'blank': 'True'})
+        },
+        u'tags.tagcooccurrence': {
+            'Meta': {'unique_together': "[['tag_a', 'tag_b']]", 'object_name': 'TagCooccurrence'},
+            'count': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'tag_a': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'cooccurrences'", 'to': u"orm['tags.Tag']"}),
+            'tag_b': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'+'", 'to': u"orm['tags.Tag']"})
+        }
+    }
+
+    complete_apps = ['tags']
\ No newline at end of file
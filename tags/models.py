@@ -1,14 +1,18 @@
 import datetime
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
+from django.core.signals import request_finished
 from django.core.urlresolvers import reverse
-from django.db import transaction
-from django.db.models import permalink, Count
+from django.db import transaction, connection, IntegrityError
+from django.db.models import permalink, Count, F
+from django.db.models import get_models
+from django.db.models.signals import m2m_changed, pre_delete
 from django.db.models.query import QuerySet
 from django.db.transaction import atomic
 from django.utils.timezone import now
 from django.db import models
 from django.template.defaultfilters import slugify
+from tags.postings import TagPostings
 
 
 class Tag(models.Model):
@@ -48,10 +52,116 @@ class Tag(models.Model):
     def get_absolute_url(self):
         return reverse('articles_list_by_tag', kwargs={'tag': self.title})
 
+    def related(self, n=None):
+        """
+        Return the tags most often used together with this one, as a list of Tag objects annotated with the number
+        of objects they share as uses_count; ties are broken by how much each tag is used overall.
+
+        :param n: the maximum number of tags to return
+        """
+        cooccurrences = list(TagCooccurrence.objects.filter(tag_a=self, count__gt=0).exclude(tag_b=self)
+                             .select_related('tag_b'))
+        totals = dict(TagCooccurrence.objects.filter(tag_a__in=[c.tag_b_id for c in cooccurrences])
+                      .filter(tag_b=F('tag_a')).values_list('tag_a', 'count'))
+        cooccurrences.sort(key=lambda c: (c.count, totals.get(c.tag_b_id, 0)), reverse=True)
+        tags = []
+        for cooccurrence in cooccurrences[:n]:
+            cooccurrence.tag_b.uses_count = cooccurrence.count
+            tags.append(cooccurrence.tag_b)
+        return tags
+
     def __unicode__(self):
         return self.verbose_title or self.title
 
 
+class TagCooccurrenceManager(models.Manager):
+    def find_existing(self, pairs):
+        """
+        Return a dict of (tag_a_id, tag_b_id) -> pk for the pairs which already have a row.
+        """
+        candidates = self.filter(tag_a__in=set(a for a, b in pairs), tag_b__in=set(b for a, b in pairs))
+        return dict(((a, b), pk) for pk, a, b in candidates.values_list('pk', 'tag_a', 'tag_b') if (a, b) in pairs)
+
+    def update_counts(self, pairs, change):
+        """
+        Add change to the count of every (tag_a_id, tag_b_id) pair, creating or dropping rows as needed.
+        """
+        pairs = set(pairs)
+        if not pairs:
+            return
+        existing = self.find_existing(pairs)
+        if existing:
+            self.filter(pk__in=existing.values()).update(count=F('count') + change)
+        missing = pairs - set(existing)
+        if change > 0 and missing:
+            try:
+                with atomic():  # A savepoint, so that a conflict doesn't spoil the whole transaction
+                    self.bulk_create([TagCooccurrence(tag_a_id=a, tag_b_id=b, count=change) for a, b in missing])
+            except IntegrityError:  # Somebody else created some of the pairs meanwhile, which can be updated now
+                self.update_counts(missing, change)
+        elif change < 0 and existing:
+            self.filter(pk__in=existing.values(), count__lte=0).delete()
+
+    def record_tagging(self, changed_ids, tag_ids, change):
+        """
+        Account for changed_ids being added to (change=1) or removed from (change=-1) an object, whose tags
+        (including the changed ones) are tag_ids.
+        """
+        pairs = set()
+        for a in changed_ids:
+            for b in tag_ids:
+                pairs.update([(a, b), (b, a)])
+        self.update_counts(pairs, change)
+
+    def rebuild(self):
+        """
+        Recompute every count from the tags of the objects of all the Taggable models, fixing any drift.
+
+        :return: the number of pairs
+        """
+        selects, params = [], []
+        for model in get_models():
+            if not issubclass(model, Taggable):
+                continue
+            field = model.tags.field
+            through = field.rel.through._meta
+            tagged_object = through.get_field(field.m2m_field_name()).column
+            tag = through.get_field(field.m2m_reverse_field_name()).column
+            counted_sql, counted_params = model.counted_in_tag_cooccurrences().values('pk').query.sql_with_params()
+            selects.append('SELECT a.{tag} AS tag_a_id, b.{tag} AS tag_b_id FROM {through} a '
+                           'JOIN {through} b ON a.{tagged_object} = b.{tagged_object} '
+                           'WHERE a.{tagged_object} IN ({counted})'.format(tag=tag, tagged_object=tagged_object,
+                                                                          through=through.db_table,
+                                                                          counted=counted_sql))
+            params.extend(counted_params)
+        with atomic():
+            self.all().delete()
+            if not selects:
+                return 0
+            cursor = connection.cursor()
+            cursor.execute('INSERT INTO {table} (tag_a_id, tag_b_id, count) '
+                           'SELECT tag_a_id, tag_b_id, COUNT(*) FROM ({pairs}) pairs '
+                           'GROUP BY tag_a_id, tag_b_id'.format(table=self.model._meta.db_table,
+                                                                pairs=' UNION ALL '.join(selects)), params)
+            return cursor.rowcount
+
+
+class TagCooccurrence(models.Model):
+    """
+    How many objects are tagged with both tag_a and tag_b.
+
+    Every pair is stored in both directions, and the (tag, tag) rows hold how many objects have the tag at all.
+    """
+    tag_a = models.ForeignKey(Tag, related_name='cooccurrences')
+    tag_b = models.ForeignKey(Tag, related_name='+')
+    count = models.PositiveIntegerField(default=0)
+
+    objects = TagCooccurrenceManager()
+
+    class Meta:
+        unique_together = [['tag_a', 'tag_b']]
+
+
 class TaggableManager(models.Manager):
     def get_tags_by_count(self, tagged_objects=None):
         """
@@ -70,6 +180,35 @@ class TaggableManager(models.Manager):
         tag_ids = qs.values_list('tags', flat=True)
         return Tag.objects.filter(pk__in=tag_ids).annotate(uses_count=Count(lookup)).order_by('-uses_count')
 
+    def tagged_with_all_pks(self, titles):
+        """
+        Return a subquery with the pks of the objects tagged with every one of the given tag titles.
+
+        It's a single GROUP BY over the tags table, HAVING as many matches as titles, however many titles there are.
+        """
+        titles = set(titles)
+        field = self.model.tags.field
+        tagged_object = field.m2m_field_name()
+        return field.rel.through.objects.filter(**{field.m2m_reverse_field_name() + '__title__in': titles})\
+            .values(tagged_object).annotate(matches=Count('pk')).filter(matches=len(titles))\
+            .values_list(tagged_object, flat=True)
+
+    def tagged_with_all_ids(self, titles):
+        """
+        Return the pks of the objects tagged with every one of the given tag titles.
+
+        The in-process postings index answers with a list when it's fresh; otherwise, this falls back to the subquery
+        from tagged_with_all_pks. Either way, it's meant for intersections: a single tag is better served by a join.
+        """
+        postings = TagPostings.for_model(self.model)
+        if not postings.ensure_fresh():
+            return self.tagged_with_all_pks(titles)
+        titles = set(titles)
+        tag_ids = Tag.objects.filter(title__in=titles).values_list('pk', flat=True)
+        if len(tag_ids) < len(titles):
+            return []
+        return list(postings.tagged_with_all(tag_ids))
+
 
 class Taggable(models.Model):
     """
@@ -78,6 +217,25 @@ class Taggable(models.Model):
     tags = models.ManyToManyField(Tag, related_name='tagged_%(class)s_set', blank=True, null=True)
     objects_as_tagged = TaggableManager()
 
+    @property
+    def counts_in_tag_cooccurrences(self):
+        """
+        Whether the tags of the object are counted in TagCooccurrence; subclasses can leave some objects out, as long
+        as they call record_tag_cooccurrences() when that changes, and counted_in_tag_cooccurrences() agrees.
+        """
+        return True
+
+    @classmethod
+    def counted_in_tag_cooccurrences(cls):
+        return cls._default_manager.all()
+
+    def record_tag_cooccurrences(self, change):
+        """
+        Add (change=1) or remove (change=-1) all the tags of the object to or from the TagCooccurrence counts.
+        """
+        tag_ids = list(self.tags.values_list('pk', flat=True))
+        TagCooccurrence.objects.record_tagging(tag_ids, tag_ids, change)
+
     @transaction.atomic
     def set_tag(self, tag):
         created = False
@@ -98,4 +256,68 @@ class Taggable(models.Model):
                                               'object_id': self.pk}
 
     class Meta:
-        abstract = True
\ No newline at end of file
+        abstract = True
+
+
+def handler_tag_cooccurrences(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action not in ('post_add', 'pre_remove', 'pre_clear'):
+        return
+    change = 1 if action == 'post_add' else -1
+    if reverse:  # Tagged objects being added to or removed from a tag
+        if not issubclass(model, Taggable) or sender is not model.tags.through:
+            return
+        tagged = model._default_manager.filter(tags=instance)
+        if pk_set is not None:
+            tagged = tagged.filter(pk__in=pk_set)
+        for tagged_object in tagged:
+            if not tagged_object.counts_in_tag_cooccurrences:
+                continue
+            TagCooccurrence.objects.record_tagging([instance.pk], tagged_object.tags.values_list('pk', flat=True),
+                                                   change)
+    elif isinstance(instance, Taggable) and sender is instance.__class__.tags.through:
+        if not instance.counts_in_tag_cooccurrences:
+            return
+        tag_ids = set(instance.tags.values_list('pk', flat=True))
+        if action == 'post_add':
+            changed_ids = pk_set
+        elif action == 'pre_remove':
+            changed_ids = tag_ids & set(pk_set)
+        else:
+            changed_ids = tag_ids
+        TagCooccurrence.objects.record_tagging(changed_ids, tag_ids, change)
+
+
+def handler_tag_postings(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action not in ('post_add', 'pre_remove', 'pre_clear'):
+        return
+    if reverse:  # Tagged objects being added to or removed from a tag
+        if not issubclass(model, Taggable) or sender is not model.tags.through:
+            return
+        object_ids = pk_set
+        if action == 'pre_clear':
+            object_ids = model._default_manager.filter(tags=instance).values_list('pk', flat=True)
+        TagPostings.for_model(model).record([instance.pk], list(object_ids))
+    elif isinstance(instance, Taggable) and sender is instance.__class__.tags.through:
+        tag_ids = pk_set
+        if action == 'pre_clear':
+            tag_ids = instance.tags.values_list('pk', flat=True)
+        TagPostings.for_model(instance.__class__).record(list(tag_ids), [instance.pk])
+
+
+def handler_tag_postings_on_request_finished(**kwargs):
+    # Without ATOMIC_REQUESTS, the transactions of the request are all over by now
+    for postings in TagPostings.indexes.values():
+        postings.flush()
+
+
+def handler_tag_cooccurrences_on_delete(sender, instance, **kwargs):
+    # Deleting an object drops its tags without any m2m_changed signal
+    if isinstance(instance, Taggable) and instance.counts_in_tag_cooccurrences:
+        instance.record_tag_cooccurrences(-1)
+
+
+m2m_changed.connect(handler_tag_cooccurrences, weak=False, dispatch_uid='tag_cooccurrences')
+pre_delete.connect(handler_tag_cooccurrences_on_delete, weak=False, dispatch_uid='tag_cooccurrences_on_delete')
+m2m_changed.connect(handler_tag_postings, weak=False, dispatch_uid='tag_postings')
+request_finished.connect(handler_tag_postings_on_request_finished, weak=False,
+                         dispatch_uid='tag_postings_on_request_finished')
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+from array import array
+from bisect import bisect_left
+import logging
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+
+logger = logging.getLogger(__name__)
+
+
+def intersect(postings):
+    """
+    Intersect sorted arrays of ids, starting from the shortest one and skipping ahead with bisect in the others.
+    """
+    postings = sorted(postings, key=len)
+    if not postings:
+        return array('l')
+    result = array('l', postings[0])
+    for other in postings[1:]:
+        matches, position = array('l'), 0
+        for item in result:
+            position = bisect_left(other, item, position)
+            if position == len(other):
+                break
+            if other[position] == item:
+                matches.append(item)
+        result = matches
+    return result
+
+
+class TagPostings(object):
+    """
+    In-process inverted index from tag id to the sorted array of the ids of the objects of a Taggable model with it.
+
+    The index is kept up to date by the tags m2m_changed handler, through record() and flush(): changes are only
+    applied, as they turn out to be in the database, once the transactions making them are over. Other processes may
+    change the tags too, so a version number is kept in the shared cache and bumped on every flush: when it doesn't
+    match the one the index is at, the index is stale and it's rebuilt from the database in a background thread, one
+    rebuild at a time and at most once every TAG_POSTINGS_REBUILD_INTERVAL seconds; meanwhile, callers are expected to
+    fall back to the database. The index is built the same way the first time it's needed.
+
+    This only works if the cache is shared by all the processes (see TAG_POSTINGS_ENABLED).
+    """
+    indexes = {}
+
+    def __init__(self, model):
+        self.model = model
+        self.lock = threading.Lock()
+        self.postings = {}
+        self.version = None
+        self.built_at = 0
+        self.rebuilding = False
+        self.rebuild_started_at = 0
+        self.local = threading.local()  # The changes recorded by each thread, which has its own transactions
+
+    @classmethod
+    def for_model(cls, model):
+        return cls.indexes.setdefault(model, cls(model))
+
+    @property
+    def version_cache_key(self):
+        return 'tags:postings:{}:version'.format(self.model._meta.db_table)
+
+    def current_version(self):
+        version = cache.get(self.version_cache_key)
+        if version is None:
+            # Starting from the clock, so that no index can mistake the new version for the one it's at
+            cache.add(self.version_cache_key, int(time.time() * 1000), None)
+            version = cache.get(self.version_cache_key)
+        return version
+
+    def rebuild(self):
+        started_at = time.time()
+        version = self.current_version()  # Read first, so that changes made while loading leave the index stale
+        field = self.model.tags.field
+        tag, tagged_object = field.m2m_reverse_field_name(), field.m2m_field_name()
+        rows = field.rel.through.objects.order_by(tag, tagged_object).values_list(tag, tagged_object)
+        postings = {}
+        for tag_id, object_id in rows.iterator():
+            postings.setdefault(tag_id, array('l')).append(object_id)
+        with self.lock:
+            if self.built_at > started_at:
+                return  # Somebody else rebuilt it meanwhile, from more recent data
+            self.postings, self.version, self.built_at = postings, version, time.time()
+
+    def rebuild_in_background(self):
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception('Could not rebuild the tag postings of %s', self.model.__name__)
+        finally:
+            connection.close()  # The thread's own connection, which nobody else is going to close
+            with self.lock:
+                self.rebuilding = False
+
+    def start_rebuild(self):
+        """
+        Start rebuilding the index in a background thread, unless a rebuild is running or one started too recently.
+        """
+        with self.lock:
+            if self.rebuilding or time.time() - self.rebuild_started_at < settings.TAG_POSTINGS_REBUILD_INTERVAL:
+                return
+            self.rebuilding, self.rebuild_started_at = True, time.time()
+        thread = threading.Thread(target=self.rebuild_in_background, name='tag-postings-rebuild')
+        thread.daemon = True
+        thread.start()
+
+    def is_fresh(self):
+        return self.version is not None and self.version == self.current_version() and \
+            time.time() - self.built_at < settings.TAG_POSTINGS_MAX_AGE
+
+    def ensure_fresh(self):
+        """
+        Start a rebuild of the index if it's stale, without waiting for it.
+
+        :return: whether the index can be used right now
+        """
+        if not settings.TAG_POSTINGS_ENABLED:
+            return False
+        if not connection.in_atomic_block:
+            self.flush()  # Changes made outside of requests, like in management commands
+        if self.is_fresh():
+            return True
+        self.start_rebuild()
+        return False
+
+    def record(self, tag_ids, object_ids):
+        """
+        Take note that the tagging of every object in object_ids with every tag in tag_ids is being changed.
+
+        Nothing is applied until flush(), since the transaction making the change may still be rolled back.
+        """
+        if not settings.TAG_POSTINGS_ENABLED:
+            return
+        pending = getattr(self.local, 'pending', None)
+        if pending is None:
+            pending = self.local.pending = set()
+        pending.update((tag_id, object_id) for tag_id in tag_ids for object_id in object_ids)
+
+    def flush(self):
+        """
+        Apply the changes recorded by this thread as they are in the database, and let the other processes know.
+
+        Meant to be called once the transactions that made the changes are over (see the request_finished handler):
+        the changes rolled back are found undone in the database, and left out.
+        """
+        pairs, self.local.pending = getattr(self.local, 'pending', None), None
+        if not pairs:
+            return
+        field = self.model.tags.field
+        tag, tagged_object = field.m2m_reverse_field_name(), field.m2m_field_name()
+        present = set(field.rel.through.objects.filter(**{
+            tag + '__in': set(tag_id for tag_id, object_id in pairs),
+            tagged_object + '__in': set(object_id for tag_id, object_id in pairs),
+        }).values_list(tag, tagged_object))
+        try:
+            version = cache.incr(self.version_cache_key)
+        except ValueError:  # The version is gone, so every index is stale anyway
+            return
+        with self.lock:
+            if self.version is None or version != self.version + 1:
+                return  # Somebody else changed the tags meanwhile, so this index has to be rebuilt anyway
+            for tag_id, object_id in pairs:
+                posting = self.postings.setdefault(tag_id, array('l'))
+                position = bisect_left(posting, object_id)
+                found = position < len(posting) and posting[position] == object_id
+                if (tag_id, object_id) in present and not found:
+                    posting.insert(position, object_id)
+                elif (tag_id, object_id) not in present and found:
+                    del posting[position]
+            self.version = version
+
+    def tagged_with_all(self, tag_ids):
+        """
+        Return the sorted array of the ids of the objects tagged with all of tag_ids.
+        """
+        with self.lock:
+            return intersect([self.postings.get(tag_id, array('l')) for tag_id in tag_ids])
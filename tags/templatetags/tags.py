@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+from django.conf import settings
 from django.template import Library
 from django.db.models.loading import get_model
 Article = get_model('articles', 'Article')
@@ -8,4 +9,6 @@ register = Library()
 
 @register.inclusion_tag('tags/tag_list.html', takes_context=True)
 def tags_list(context, css_class=''):
-    return {'tags': Article.objects.get_trending_tags, 'css_class': css_class}
+    return {'tags': Article.objects.get_trending_tags, 'css_class': css_class,
+            'page_cache_generation': Article.objects.get_page_cache_generation,
+            'fragment_cache_timeout': settings.FRAGMENT_CACHE_TIMEOUT}
@@ -1,13 +1,21 @@
 import datetime
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
 from django.db import models
 from django.db.models.query import QuerySet
 from django.db.utils import IntegrityError
+from django.db.transaction import atomic
 from django.test import TestCase
+from django.test.utils import override_settings
 from django.utils.timezone import now
 from django.utils.unittest.case import skip
 from django_dynamic_fixture import G
+import mock
+from StringIO import StringIO
 
-from tags.models import Tag, Taggable
+from tags.models import Tag, Taggable, TagCooccurrence
+from tags.postings import TagPostings
 
 
 class TaggableMixinTest(TestCase):
@@ -76,6 +84,135 @@ class TaggableMixinTest(TestCase):
         qs = BasicModel.objects_as_tagged.get_tags_by_count([o1.pk, o2.pk])
         self.assertSequenceEqual([t3, t1, ], qs)
 
+    def test_tag_cooccurrences_are_kept_up_to_date(self):
+        o1, o2, o3 = G(BasicModel, n=3)
+        t1, t2, t3, t4 = G(Tag, n=4)
+        o1.set_tag(t1)
+        o1.set_tag(t2)
+        o2.tags.add(t1, t2, t3)
+        t1.tagged_basicmodel_set.add(o3)  # From the other side, too
+        o3.set_tag(t4)
+        counts = lambda tag: dict((t.pk, t.uses_count) for t in tag.related())
+        self.assertEqual(counts(t1), {t2.pk: 2, t3.pk: 1, t4.pk: 1})
+        self.assertEqual(counts(t3), {t1.pk: 1, t2.pk: 1})
+        # Every pair is stored in both directions, plus the overall count of every tag
+        self.assertEqual(TagCooccurrence.objects.get(tag_a=t1, tag_b=t1).count, 3)
+        self.assertEqual(TagCooccurrence.objects.get(tag_a=t2, tag_b=t1).count, 2)
+        o2.tags.remove(t2)
+        self.assertEqual(counts(t1), {t2.pk: 1, t3.pk: 1, t4.pk: 1})
+        self.assertEqual(counts(t3), {t1.pk: 1})
+        o1.tags.clear()
+        t4.tagged_basicmodel_set.remove(o3)
+        self.assertEqual(counts(t1), {t3.pk: 1})
+        self.assertEqual(TagCooccurrence.objects.get(tag_a=t1, tag_b=t1).count, 2)
+
+    def test_tag_cooccurrences_survive_concurrent_taggings(self):
+        o1, o2 = G(BasicModel, n=2)
+        t1 = G(Tag)
+        o1.tags.add(t1)
+        # Somebody else creates the pair between the lookup and the insert
+        TagCooccurrence.objects.all().delete()
+        TagCooccurrence.objects.create(tag_a=t1, tag_b=t1, count=1)
+        find_existing = TagCooccurrence.objects.find_existing
+        lookups = []
+
+        def racing_find_existing(pairs):
+            lookups.append(pairs)
+            return {} if len(lookups) == 1 else find_existing(pairs)
+        with mock.patch.object(TagCooccurrence.objects, 'find_existing', side_effect=racing_find_existing):
+            o2.tags.add(t1)
+        self.assertEqual(len(lookups), 2)
+        self.assertEqual(TagCooccurrence.objects.get(tag_a=t1, tag_b=t1).count, 2)
+
+    def test_tag_cooccurrences_can_be_rebuilt(self):
+        o1, o2 = G(BasicModel, n=2)
+        t1, t2 = G(Tag, n=2)
+        o1.tags.add(t1, t2)
+        o2.tags.add(t1)
+        expected = sorted(TagCooccurrence.objects.values_list('tag_a', 'tag_b', 'count'))
+        TagCooccurrence.objects.filter(tag_a=t1, tag_b=t1).update(count=10)
+        TagCooccurrence.objects.filter(tag_a=t1, tag_b=t2).delete()
+        out = StringIO()
+        call_command('rebuild_tag_cooccurrences', stdout=out)
+        self.assertEqual(sorted(TagCooccurrence.objects.values_list('tag_a', 'tag_b', 'count')), expected)
+        self.assertIn('Counted 4 pairs', out.getvalue())
+        # Deleting objects drops their tags without m2m_changed, but they're accounted for anyway
+        o1.delete()
+        self.assertEqual(TagCooccurrence.objects.get(tag_a=t1, tag_b=t1).count, 1)
+        self.assertFalse(TagCooccurrence.objects.filter(tag_a=t1, tag_b=t2).exists())
+
+    def test_related_tags_are_sorted_by_cooccurrence_then_by_usage(self):
+        objects = G(BasicModel, n=4)
+        t1, t2, t3, t4 = G(Tag, n=4)
+        for o in objects[:2]:
+            o.tags.add(t1, t2)
+        objects[2].tags.add(t1, t3)
+        objects[3].tags.add(t1, t4)
+        G(BasicModel).tags.add(t4)  # t4 is used more than t3, overall
+        self.assertSequenceEqual(t1.related(), [t2, t4, t3])
+        self.assertSequenceEqual(t1.related(2), [t2, t4])
+
+    @override_settings(TAG_POSTINGS_ENABLED=True)
+    def test_tag_postings_are_kept_up_to_date(self):
+        postings = TagPostings.for_model(BasicModel)
+        postings.rebuild()
+        o1, o2, o3 = G(BasicModel, n=3)
+        t1, t2, t3 = G(Tag, n=3)
+        o3.set_tag(t1)
+        o1.set_tag(t1)
+        o2.tags.add(t1, t2)
+        t2.tagged_basicmodel_set.add(o3)  # From the other side, too
+        # The changes are only applied once their transactions are over, as they are in the database
+        self.assertNotIn(t1.pk, postings.postings)
+        with self.assertRaises(ValueError), atomic():
+            o1.tags.add(t2)
+            raise ValueError
+        postings.flush()
+        self.assertTrue(postings.is_fresh())
+        self.assertSequenceEqual(postings.postings[t1.pk], [o1.pk, o2.pk, o3.pk])
+        self.assertSequenceEqual(postings.tagged_with_all([t1.pk, t2.pk]), [o2.pk, o3.pk])
+        o2.tags.remove(t2)
+        o3.tags.add(t3)
+        postings.flush()
+        self.assertSequenceEqual(postings.tagged_with_all([t1.pk, t2.pk]), [o3.pk])
+        t3.tagged_basicmodel_set.clear()
+        o1.tags.clear()
+        postings.flush()
+        self.assertSequenceEqual(postings.tagged_with_all([t1.pk]), [o2.pk, o3.pk])
+        self.assertSequenceEqual(postings.tagged_with_all([t3.pk]), [])
+        # Rebuilding from the database gives the same result
+        expected = dict((tag_id, list(posting)) for tag_id, posting in postings.postings.items() if posting)
+        postings.rebuild()
+        self.assertEqual(dict((tag_id, list(posting)) for tag_id, posting in postings.postings.items()), expected)
+
+    @override_settings(TAG_POSTINGS_ENABLED=True)
+    def test_tagged_with_all_ids_falls_back_to_the_database_when_postings_are_stale(self):
+        postings = TagPostings.for_model(BasicModel)
+        postings.rebuild()
+        o1, o2 = G(BasicModel, n=2)
+        t1, t2 = G(Tag, n=2)
+        o1.tags.add(t1, t2)
+        o2.tags.add(t1)
+        postings.flush()
+        with self.assertNumQueries(1):  # Only the tag ids come from the database
+            self.assertSequenceEqual(BasicModel.objects_as_tagged.tagged_with_all_ids([t1.title, t2.title]), [o1.pk])
+        self.assertSequenceEqual(BasicModel.objects_as_tagged.tagged_with_all_ids([t1.title, 'missing']), [])
+        cache.incr(postings.version_cache_key)  # Some other process changed the tags
+        self.assertFalse(postings.is_fresh())
+        with mock.patch('tags.postings.threading.Thread') as thread:
+            pks = BasicModel.objects_as_tagged.tagged_with_all_ids([t1.title, t2.title])
+            self.assertIsInstance(pks, QuerySet)
+            self.assertSequenceEqual(list(pks), [o1.pk])
+            BasicModel.objects_as_tagged.tagged_with_all_ids([t1.title, t2.title])
+        # The index is rebuilt in the background, by one thread at a time
+        self.assertEqual(thread.call_count, 1)
+        with mock.patch('tags.postings.connection'):  # Which would be the thread's own, but it's the test's here
+            thread.call_args[1]['target']()
+        self.assertFalse(postings.rebuilding)
+        self.assertTrue(postings.is_fresh())
+        with self.assertNumQueries(1):
+            self.assertSequenceEqual(BasicModel.objects_as_tagged.tagged_with_all_ids([t1.title, t2.title]), [o1.pk])
+
 
 class TagModelTestCase(TestCase):
     @skip('Made obsolete by changes in save() method')